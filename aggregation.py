@@ -0,0 +1,77 @@
+import numpy as np
+
+# Online statistics of the replicas of a cell: every replica is added as soon
+# as it arrives and then dropped, so the memory is O(T) per cell instead of
+# O(nsim * T).
+
+
+def pad(x, length):
+    """x (1d) padded with zeros up to length"""
+    return np.concatenate([x, np.zeros(length - len(x))]) if len(x) < length else x
+
+
+class Welford:
+    """Running mean and variance (Welford's algorithm) of scalars or of time
+    series. Time series of different lengths are padded with zeros: an
+    epidemic that is over has no infectious, so the tails of the longer
+    replicas are kept instead of being truncated to the shortest one."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+
+    def add(self, x):
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        length = max(len(x), len(self.mean))
+        x = pad(x, length)
+        self.mean = pad(self.mean, length)
+        self.m2 = pad(self.m2, length)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def var(self):
+        """Population variance (same as np.var / np.std with ddof=0)"""
+        return self.m2 / self.n
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def halfwidth(self, z=1.96):
+        """Half width of the normal confidence interval of the mean (z = 1.96
+        for 95%), from the sample variance; infinite with less than 2 items"""
+        if self.n < 2:
+            return np.full(len(self.mean), np.inf)
+        return z * np.sqrt(self.m2 / (self.n - 1) / self.n)
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` items of a stream (algorithm R),
+    used to estimate quantiles with bounded memory. The quantiles are exact
+    as long as the stream has no more than `size` items."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.n = 0
+        self.items = []
+
+    def add(self, x):
+        self.n += 1
+        if len(self.items) < self.size:
+            self.items.append(x)
+        else:
+            k = int(self.rng.integers(self.n))
+            if k < self.size:
+                self.items[k] = x
+
+    def quantile(self, q, key=None, length=None):
+        """Quantile q of the sampled items, or of key(item) if key is given
+        (time series are padded with zeros up to length)"""
+        items = [np.atleast_1d(np.asarray(x if key is None else key(x), dtype=float)) for x in self.items]
+        length = length or max(len(x) for x in items)
+        return np.quantile([pad(x, length) for x in items], q, axis=0)
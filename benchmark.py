@@ -0,0 +1,215 @@
+import numpy as np
+import networkx as nx
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from utils import SIR_net, SIR_net_adaptive, initNET_SI, initNET_rnd
+from fast_utils import SIR_net_adaptive_csr, SIR_net_active, graph_to_csr, average_clustering
+from gillespie import SIR_net_gillespie, SIR_net_adaptive_gillespie
+from networks import barabasi_albert_edges
+import simulation
+
+# Benchmarks of the simulation kernels:
+#   python benchmark.py run --sizes 1000 10000 100000 --output bench.json
+#   python benchmark.py compare old.json new.json
+# Every case (kernel, engine, N, degree, r, pol) is run `repeat` times on the
+# same Barabasi-Albert network (built once per N and degree, not timed) and
+# the JSON file gets the median wall time, the time steps per second and the
+# replicas per second, plus the mean attack rate to check the engines
+# against the reference one. A kernel whose median time exceeds --max-seconds
+# is not run on the larger networks.
+
+adaptive_engines = {'networkx': SIR_net_adaptive, 'csr': SIR_net_adaptive_csr, 'gillespie': SIR_net_adaptive_gillespie}
+sir_engines = {'networkx': SIR_net, 'active': SIR_net_active, 'gillespie': SIR_net_gillespie}
+ba_engines = {'networkx': lambda N, m, rng: nx.barabasi_albert_graph(N, m, seed=int(rng.integers(2**31))),
+              'native': barabasi_albert_edges}
+
+
+def sir_case(engine, G, N, par):
+    def run(seed):
+        rng = np.random.default_rng(seed)
+        initial_infecteds = rng.choice(N, par['n_infecteds'], replace=False)
+        H = G.copy()
+        start = time.perf_counter()
+        time_, _, _, R = sir_engines[engine](H, par['beta'], par['mu'], initial_infecteds, seed=seed)
+        return time.perf_counter() - start, len(time_) - 1, R[-1]
+    return run
+
+
+def adaptive_case(engine, G, N, par, r, pol, rewiring):
+    def run(seed):
+        rng = np.random.default_rng(seed)
+        H = G.copy()
+        NET = G.copy()
+        initNET_rnd(NET, initial_novax=rng.choice(N, int(par['n_novax'] * N / par['N']), replace=False))
+        initial_infecteds = rng.choice(N, par['n_infecteds'], replace=False)
+        start = time.perf_counter()
+        outputs = adaptive_engines[engine](H, NET, par['beta'], par['mu'], r, par['pro'], pol, initial_infecteds,
+                                           rewiring=rewiring, rng=rng, message=False)
+        return time.perf_counter() - start, len(outputs[0]) - 1, outputs[5]
+    return run
+
+
+def init_si_case(G, N, par):
+    def run(seed):
+        rng = np.random.default_rng(seed)
+        NET = G.copy()
+        I_seed = rng.choice(N, par['n_infecteds'], replace=False)
+        start = time.perf_counter()
+        initNET_SI(NET, int(par['n_novax'] * N / par['N']), I_seed, rng=rng)
+        return time.perf_counter() - start, None, None
+    return run
+
+
+def generator_case(engine, N, degree):
+    def run(seed):
+        rng = np.random.default_rng(seed)
+        start = time.perf_counter()
+        ba_engines[engine](N, degree // 2, rng)
+        return time.perf_counter() - start, None, None
+    return run
+
+
+def simulation_step_case(engine, csr, cc, N, par, r, pol):
+    step_par = dict(par, N=N, n_novax=int(par['n_novax'] * N / par['N']), engine=engine)
+
+    def run(seed):
+        start = time.perf_counter()
+        answer = simulation.simulation_step(step_par, np.random.default_rng(seed), r, pol, csr, cc)
+        return time.perf_counter() - start, sum(answer[0]) - 2, answer[2][1]
+    return run
+
+
+def cases(G, N, degree, par, args):
+    """(description, run) of every benchmark on the network G"""
+    csr = graph_to_csr(G)
+    cc = average_clustering(*csr)
+    base = {'N': N, 'degree': degree}
+    for engine in sir_engines:
+        yield dict(base, kernel='SIR_net', engine=engine), sir_case(engine, G, N, par)
+    # initNET_SI runs its frontier rounds on numpy arrays (the graph only gives the CSR and gets the attributes)
+    yield dict(base, kernel='initNET_SI', engine='numpy'), init_si_case(G, N, par)
+    for engine in ba_engines:
+        yield dict(base, kernel='barabasi_albert', engine=engine), generator_case(engine, N, degree)
+    for r in args.r:
+        for pol in args.pol:
+            for engine in args.engines:
+                for rewiring in (False, True):
+                    yield (dict(base, kernel='SIR_net_adaptive', engine=engine, r=r, pol=pol, rewiring=rewiring),
+                           adaptive_case(engine, G, N, par, r, pol, rewiring))
+                yield (dict(base, kernel='simulation_step', engine=engine, r=r, pol=pol),
+                       simulation_step_case(engine, csr, cc, N, par, r, pol))
+
+
+# fields that identify a case
+KEYS = ('kernel', 'engine', 'N', 'degree', 'r', 'pol', 'rewiring')
+
+
+def case_key(case, fields=KEYS):
+    return tuple((k, case[k]) for k in fields if k in case)
+
+
+def measure(run, repeat):
+    """Median time, steps/s and replicas/s of `repeat` runs with seeds 0, 1, ..."""
+    seconds, steps, attack = [], [], []
+    with contextlib.redirect_stdout(io.StringIO()):      # SIR_net prints every step
+        for seed in range(repeat):
+            s, n, ar = run(seed)
+            seconds.append(s)
+            steps.append(n)
+            attack.append(ar)
+    result = {'repeat': repeat, 'seconds': float(np.median(seconds)), 'replicas_per_s': repeat / sum(seconds)}
+    if steps[0] is not None:
+        result['steps'] = float(np.mean(steps))
+        result['steps_per_s'] = sum(steps) / sum(seconds)
+    if attack[0] is not None:
+        result['attack_rate'] = float(np.mean(attack))
+    return result
+
+
+def metadata(par, args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'networkx': nx.__version__,
+            'machine': platform.platform(), 'par': par, 'args': vars(args)}
+
+
+def run_benchmarks(args):
+    par = simulation.par
+    results = []
+    too_slow = set()
+    for N in args.sizes:
+        for degree in args.degrees:
+            G = nx.barabasi_albert_graph(N, degree // 2, seed=2022)
+            for case, run in cases(G, N, degree, par, args):
+                kernel = case_key(case, ('kernel', 'engine', 'r', 'pol', 'rewiring'))
+                if kernel in too_slow:
+                    print('skipped', case)
+                    continue
+                case.update(measure(run, args.repeat))
+                results.append(case)
+                print(json.dumps(case))
+                if case['seconds'] > args.max_seconds:
+                    too_slow.add(kernel)
+    with open(args.output, 'w') as f:
+        json.dump({'meta': metadata(par, args), 'results': results}, f, indent=1)
+    print(f'{len(results)} benchmarks written to {args.output}')
+
+
+def compare(args):
+    """Print the speed ratio (new / old) of the cases of two runs and return
+    the number of regressions (ratio below 1 - tolerance)"""
+    with open(args.old) as f:
+        old = {case_key(case): case for case in json.load(f)['results']}
+    with open(args.new) as f:
+        new = json.load(f)['results']
+    regressions = 0
+    for case in new:
+        key = case_key(case)
+        if key not in old:
+            continue
+        metric = 'steps_per_s' if 'steps_per_s' in case else 'replicas_per_s'
+        ratio = case[metric] / old[key][metric]
+        flag = ''
+        if ratio < 1 - args.tolerance:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif ratio > 1 + args.tolerance:
+            flag = 'faster'
+        label = ' '.join(f'{k}={v}' for k, v in key)
+        print(f'{label:90s} {metric:15s} {old[key][metric]:12.2f} -> {case[metric]:12.2f}  x{ratio:.2f} {flag}')
+    print(f'{regressions} regressions (tolerance {args.tolerance:.0%})')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation kernels')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the benchmarks and write them to a JSON file')
+    run.add_argument('--sizes', type=lambda x: int(float(x)), nargs='+', default=[1000, 10000], help='numbers of nodes N (1e5 is accepted)')
+    run.add_argument('--degrees', type=int, nargs='+', default=[10], help='average degrees of the networks')
+    run.add_argument('--r', type=float, nargs='+', default=[0.5], help='vaccination rates')
+    run.add_argument('--pol', type=float, nargs='+', default=[0.5], help='polarization propensities')
+    run.add_argument('--engines', nargs='+', choices=list(adaptive_engines), default=list(adaptive_engines))
+    run.add_argument('--repeat', type=int, default=3, help='runs per case')
+    run.add_argument('--max-seconds', type=float, default=60., help='do not run a case on larger networks once it takes longer than this')
+    run.add_argument('--output', default='benchmark.json')
+    cmp = commands.add_parser('compare', help='compare two runs and flag the regressions')
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_benchmarks(args)
+    else:
+        sys.exit(1 if compare(args) else 0)
@@ -0,0 +1,127 @@
+import numpy as np
+import json
+import os
+import pickle
+import glob
+
+# Checkpointing of the parameter sweeps of simulation.py.
+# A sweep lives in a directory with
+#   manifest.json               parameters, grid, nsim, shard and the state of every cell
+#   replicas/cell_i_j/rep_k.pkl the answer of replica k of cell (i, j)
+#   cells/cell_i_j.*.npy        the summary arrays of a completed cell (see results.py)
+# Every file is written atomically (temporary file + os.replace), so after a
+# crash a restart finds either the old or the new version of it, never a
+# partial one. Disjoint shards of the grid can run in different directories
+# (or machines) and are put together with done_cells().
+
+
+def atomic_write(path, data):
+    """Write data (str or bytes) to path atomically"""
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def replica_seed(cell, k, entropy=2022):
+    """Seed (a SeedSequence, for np.random.default_rng) of replica k of cell
+    (i, j), independent of the order in which the replicas are run (so a
+    resumed sweep draws the same numbers). The streams of different
+    replicas are independent, without the collisions of a 32 bit seed."""
+    i, j = cell
+    return np.random.SeedSequence(entropy, spawn_key=(i, j, k))
+
+
+def cell_name(cell):
+    return 'cell_{}_{}'.format(*cell)
+
+
+def save_replica(directory, cell, k, answer):
+    """Called by the workers: persist the answer of replica k of cell"""
+    path = os.path.join(directory, 'replicas', cell_name(cell))
+    os.makedirs(path, exist_ok=True)
+    atomic_write(os.path.join(path, f'rep_{k}.pkl'), pickle.dumps(answer))
+
+
+class Sweep:
+    """State of a (possibly sharded) sweep stored in `directory`.
+    The cells of the grid are numbered row by row and shard k of n gets the
+    cells whose number is k modulo n."""
+
+    def __init__(self, directory, par, nsim, r_list, pol_list, shard=0, nshards=1):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.r_list = [round(float(r), 10) for r in r_list]
+        self.pol_list = [round(float(pol), 10) for pol in pol_list]
+        manifest = {
+            'par': par,
+            'nsim': nsim,
+            'r_list': self.r_list,
+            'pol_list': self.pol_list,
+            'shard': shard,
+            'nshards': nshards}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                old = json.load(f)
+            for key, value in manifest.items():
+                if old[key] != value:
+                    raise ValueError(f'{self.manifest_path}: {key} is {old[key]}, not {value}; use another sweep directory')
+            self.manifest = old
+        else:
+            os.makedirs(os.path.join(directory, 'cells'), exist_ok=True)
+            manifest['cells'] = {cell_name(cell): 'pending' for cell in self.shard_cells(shard, nshards)}
+            self.manifest = manifest
+            self.write_manifest()
+
+    def shard_cells(self, shard, nshards):
+        n_pol = len(self.pol_list)
+        return [(i, j) for i in range(len(self.r_list)) for j in range(n_pol) if (i * n_pol + j) % nshards == shard]
+
+    def write_manifest(self):
+        atomic_write(self.manifest_path, json.dumps(self.manifest, indent=1))
+
+    def cells(self):
+        """Cells of this shard that still have to be completed"""
+        return [cell for cell in self.shard_cells(self.manifest['shard'], self.manifest['nshards'])
+                if self.manifest['cells'][cell_name(cell)] != 'done']
+
+    def done_replicas(self, cell):
+        """Indices of the replicas of cell already saved by a previous run"""
+        files = glob.glob(os.path.join(self.directory, 'replicas', cell_name(cell), 'rep_*.pkl'))
+        return sorted(int(os.path.basename(f)[4:-4]) for f in files)
+
+    def iter_replicas(self, cell):
+        """The answers of the saved replicas of cell, loaded one at a time"""
+        for k in self.done_replicas(cell):
+            with open(os.path.join(self.directory, 'replicas', cell_name(cell), f'rep_{k}.pkl'), 'rb') as f:
+                yield pickle.load(f)
+
+    @property
+    def cells_dir(self):
+        """Where the summaries of the completed cells are written"""
+        return os.path.join(self.directory, 'cells')
+
+    def complete(self, cell):
+        """Mark cell as done (after its summary has been written in cells_dir)"""
+        self.manifest['cells'][cell_name(cell)] = 'done'
+        self.write_manifest()
+
+
+def done_cells(directories):
+    """The completed cells of one or more sweep directories (e.g. the shards of
+    a grid, searched recursively), as a list of (cells directory, cell name)
+    in grid order"""
+    manifests = []
+    for directory in directories:
+        manifests += glob.glob(os.path.join(directory, '**', 'manifest.json'), recursive=True)
+    cells = {}
+    for path in sorted(manifests):
+        with open(path) as f:
+            manifest = json.load(f)
+        for name, state in manifest['cells'].items():
+            if state == 'done' and name not in cells:
+                cells[name] = os.path.join(os.path.dirname(path), 'cells')
+    order = sorted(cells, key=lambda name: tuple(int(x) for x in name.split('_')[1:]))
+    return [(cells[name], name) for name in order]
@@ -0,0 +1,657 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse
+import sys
+
+# Array-backed versions of the kernels in utils.py.
+# Both layers are kept as CSR adjacency arrays (indptr, indices) and the node
+# states as int8 arrays, so that a whole time step is a handful of NumPy
+# operations instead of Python loops over the nodes.
+
+# infectious status codes (same meaning as the 'S', 'I', 'R', 'V' strings of utils.py)
+SUS, INF, REC, VAX = 0, 1, 2, 3
+STATUS_LABELS = np.array(['S', 'I', 'R', 'V'])
+
+# opinion codes (same as 'aware_status' in utils.py): 0 = pro vax, 1 = no vax
+PROVAX, NOVAX = 0, 1
+
+
+def edges_to_csr(N, u, v):
+    """Build the CSR adjacency (indptr, indices) of an undirected graph
+    with N nodes from the two endpoint arrays u, v (one entry per edge)."""
+    src = np.concatenate([u, v])
+    dst = np.concatenate([v, u])
+    # scipy builds the CSR structure with a linear-time counting sort
+    A = scipy.sparse.csr_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(N, N))
+    return A.indptr.astype(np.int64), A.indices.astype(np.int64)
+
+
+def graph_edges(G):
+    """Return the edges of a networkx graph as two int64 arrays u, v."""
+    edges = np.array(G.edges(), dtype=np.int64).reshape(-1, 2)
+    return edges[:, 0].copy(), edges[:, 1].copy()
+
+
+def graph_to_csr(G):
+    """CSR adjacency (indptr, indices) of a networkx graph whose nodes are 0..N-1"""
+    u, v = graph_edges(G)
+    return edges_to_csr(G.number_of_nodes(), u, v)
+
+
+def csr_edges(indptr, indices):
+    """Edges (u < v) of an undirected graph given by its CSR adjacency"""
+    u = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+    keep = u < indices
+    return u[keep], np.array(indices[keep], dtype=np.int64)
+
+
+def csr_to_graph(indptr, indices):
+    """networkx Graph (nodes 0..N-1) of a CSR adjacency"""
+    G = nx.Graph()
+    G.add_nodes_from(range(len(indptr) - 1))
+    G.add_edges_from(zip(*(x.tolist() for x in csr_edges(indptr, indices))))
+    return G
+
+
+def average_clustering(indptr, indices):
+    """Average clustering coefficient of a CSR adjacency, as
+    nx.average_clustering (nodes with degree < 2 count as 0), computed from
+    the triangles through every node with one sparse product"""
+    return clustering_from_triangles(indptr, node_triangles(indptr, indices))
+
+
+def node_triangles(indptr, indices):
+    """Number of triangles through every node of a CSR adjacency"""
+    A = csr_matrix(indptr, indices)
+    return np.asarray(A.dot(A).multiply(A).sum(axis=1)).ravel().astype(np.int64) // 2
+
+
+def clustering_from_triangles(indptr, triangles):
+    """Average clustering coefficient given the triangles through every node"""
+    deg = np.diff(indptr)
+    pairs = deg * (deg - 1) / 2
+    cc = np.divide(triangles, pairs, out=np.zeros(len(deg)), where=pairs > 0)
+    return float(cc.mean())
+
+
+def triangles_through(indptr, indices, keys, a, b):
+    """Triangles of a graph that contain at least one of the edges (a, b),
+    as unique sorted node triples. keys: the edge_keys of all its edges. The common neighbours of every
+    edge are found by scanning the neighbours of its end of lower degree."""
+    N = len(indptr) - 1
+    deg = np.diff(indptr)
+    low = np.where(deg[a] <= deg[b], a, b)
+    high = np.where(deg[a] <= deg[b], b, a)
+    c = gather_neighbors(indptr, indices, low)
+    x = np.repeat(low, deg[low])
+    y = np.repeat(high, deg[low])
+    k = np.minimum(y, c) * N + np.maximum(y, c)
+    pos = np.minimum(np.searchsorted(keys, k), len(keys) - 1)
+    closed = (keys[pos] == k) if len(keys) else np.zeros(len(k), dtype=bool)
+    tri = np.sort(np.stack([x[closed], y[closed], c[closed]], axis=1), axis=1)
+    return np.unique(tri, axis=0)
+
+
+def update_triangles(triangles, old, new, N):
+    """Update the triangles through every node after the edges of the graph
+    changed from old to new, both (indptr, indices, keys): the triangles of
+    the cut edges are removed and those of the added edges are counted, so
+    the cost follows the rewired edges and not the whole graph."""
+    cut = np.setdiff1d(old[2], new[2], assume_unique=True)
+    added = np.setdiff1d(new[2], old[2], assume_unique=True)
+    triangles = triangles - np.bincount(triangles_through(*old, cut // N, cut % N).ravel(), minlength=N)
+    return triangles + np.bincount(triangles_through(*new, added // N, added % N).ravel(), minlength=N)
+
+
+def csr_matrix(indptr, indices):
+    """Wrap a CSR adjacency in a scipy sparse matrix (used for neighbour counts)"""
+    N = len(indptr) - 1
+    data = np.ones(len(indices), dtype=np.int32)
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=(N, N))
+
+
+def node_attribute_array(G, name, dtype=np.int8):
+    """Collect the node attribute `name` of G (nodes 0..N-1) into an array"""
+    values = nx.get_node_attributes(G, name)
+    return np.array([values[i] for i in range(G.number_of_nodes())], dtype=dtype)
+
+
+def canonical_edges(N, u, v):
+    """Drop self-loops and duplicated edges (a networkx Graph would merge the
+    duplicates but keep the self-loops; the rewiring of utils.SIR_net_adaptive
+    does not create them either)"""
+    keep = u != v
+    u, v = u[keep], v[keep]
+    lo = np.minimum(u, v)
+    hi = np.maximum(u, v)
+    keys = np.sort(lo * N + hi)
+    keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+    return keys // N, keys % N
+
+
+def edge_keys(N, u, v):
+    """Sorted keys lo * N + hi of the edges u, v"""
+    return np.sort(np.minimum(u, v) * N + np.maximum(u, v))
+
+
+def uniforms(rng, keys, block):
+    """One uniform number in [0, 1) per element of `keys`, the sorted node ids
+    of a batch whose replica m owns the ids m*block ... (m+1)*block-1.
+    rng is a Generator shared by the batch, or a list of Generators, one per
+    replica: then each replica draws its numbers in one block from its own
+    stream, and its results do not depend on the other replicas."""
+    if not isinstance(rng, list):
+        return rng.random(len(keys))
+    counts = np.bincount(np.asarray(keys, dtype=np.int64) // block, minlength=len(rng))
+    return np.concatenate([np.zeros(0)] + [g.random(c) for g, c in zip(rng, counts)])
+
+
+def random_neighbors(indptr, indices, nodes, rng, u=None):
+    """Draw one uniformly random neighbour for each node of `nodes`
+    (all of them must have at least one neighbour); u: the uniform numbers
+    to use, by default drawn from rng."""
+    start = indptr[nodes]
+    deg = indptr[nodes + 1] - start
+    if u is None:
+        u = rng.random(len(nodes))
+    offset = (u * deg).astype(np.int64)
+    return indices[start + offset]
+
+
+def gather_neighbors(indptr, indices, nodes):
+    """All the neighbours of the nodes of `nodes`, concatenated (with repetitions)"""
+    starts, counts = indptr[nodes], indptr[nodes + 1] - indptr[nodes]
+    return indices[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+
+
+def sample_same_block(pool, nodes, block, rng):
+    """For every node of `nodes` draw a random element of the sorted array
+    `pool` lying in the same block of `block` consecutive node ids
+    (a block is one replica in the batched engine, the whole graph otherwise).
+    Each node must have at least one pool element in its block."""
+    n_blocks = int(nodes.max()) // block + 1
+    counts = np.bincount(pool // block, minlength=n_blocks)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    b = nodes // block
+    return pool[starts[b] + (uniforms(rng, nodes, block) * counts[b]).astype(np.int64)]
+
+
+def rewire_edges(N, u, v, aware, pol, rng, block=None):
+    """One rewiring sweep of the information network stored as edge arrays.
+    Every discordant edge is cut with probability pol and replaced by two
+    edges, one linking the no vax end to a random no vax node and one linking
+    the pro vax end to a random pro vax node (of the same block, see
+    sample_same_block; by default the block is the whole network).
+    rng: Generator or one Generator per block (see uniforms).
+    Returns the new edges and the number of cut edges; the input arrays are
+    returned unchanged (same objects) if nothing was cut."""
+    if block is None:
+        block = N
+    discordant = np.flatnonzero(aware[u] != aware[v])
+    cut = discordant[uniforms(rng, u[discordant], block) < pol]
+    if len(cut) == 0:
+        return u, v, 0
+    novax = np.flatnonzero(aware == NOVAX)
+    provax = np.flatnonzero(aware == PROVAX)
+    nv_end = np.where(aware[u[cut]] == NOVAX, u[cut], v[cut])
+    pv_end = np.where(aware[u[cut]] == NOVAX, v[cut], u[cut])
+    keep = np.ones(len(u), dtype=bool)
+    keep[cut] = False
+    new_u = np.concatenate([u[keep], nv_end, pv_end])
+    new_v = np.concatenate([v[keep],
+                            sample_same_block(novax, nv_end, block, rng),
+                            sample_same_block(provax, pv_end, block, rng)])
+    return canonical_edges(N, new_u, new_v) + (len(cut),)
+
+
+# number of set bits of every byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int64)
+
+
+class FlipTracker:
+    """Opinion flips of N nodes (or of M replicas of N nodes, shape (M, N)):
+    a ring buffer with the bit-packed flip flags of the last 3 time steps
+    (N/8 bytes per step, whatever the length of the epidemic).
+    update(flipped) stores the flags of a new step and returns the number of
+    nodes that flipped (changers) and of those that flipped in the previous
+    step too (bichangers)."""
+
+    slots = 3
+
+    def __init__(self, shape):
+        shape = tuple(np.atleast_1d(shape))
+        self.N = shape[-1]
+        self.ring = np.zeros((self.slots,) + shape[:-1] + ((self.N + 7) // 8,), dtype=np.uint8)
+        self.t = 0
+
+    def update(self, flipped):
+        self.t += 1
+        packed = np.packbits(flipped, axis=-1)
+        self.ring[self.t % self.slots] = packed
+        both = packed & self.ring[(self.t - 1) % self.slots]
+        return POPCOUNT[packed].sum(axis=-1), POPCOUNT[both].sum(axis=-1)
+
+    def flipped(self, lag=0):
+        """Flags of the nodes that flipped lag (< 3) steps ago"""
+        return np.unpackbits(self.ring[(self.t - lag) % self.slots], axis=-1, count=self.N).astype(bool)
+
+    def select(self, rows):
+        """Keep only the given replicas of a batched tracker"""
+        self.ring = self.ring[:, rows]
+
+
+def SIR_net_active(G, beta, mu, initial_infecteds, seed=123, message=True):
+    """SIR process with the same arguments, law and outputs of utils.SIR_net
+    (a susceptible with k infectious neighbours is infected with probability
+    1 - (1 - beta)^k), for large sparse networks with small outbreaks.
+    G is a networkx graph or a CSR adjacency (indptr, indices).
+    Only the infectious nodes and their neighbours are touched: every step
+    gathers the neighbours of the infectious, draws one coin per exposed
+    susceptible and one per infectious, and updates the S, I, R counters
+    with the transitions, so a step costs O(|I| k) instead of O(N).
+    The final status (0 = susceptible; 1 = infectious; 2 = recovered) is
+    written into the 'inf_status' attribute of a networkx G."""
+
+    rng = np.random.default_rng(seed)
+    indptr, indices = G if isinstance(G, tuple) else graph_to_csr(G)
+    N = len(indptr) - 1
+    status = np.full(N, SUS, dtype=np.int8)
+    infected = np.unique(np.asarray(initial_infecteds, dtype=np.int64))
+    status[infected] = INF
+
+    time = [0]
+    S = [N - len(infected)]
+    I = [len(infected)]
+    R = [0]
+    t = 0
+    while True:
+        t += 1
+        time.append(t)
+
+        # transmission: exposed susceptible and number of their infectious neighbours
+        neighbours = gather_neighbors(indptr, indices, infected)
+        exposed, k_inf = np.unique(neighbours[status[neighbours] == SUS], return_counts=True)
+        new_inf = exposed[rng.random(len(exposed)) < 1. - (1. - beta) ** k_inf]
+
+        # recovery
+        recovering = rng.random(len(infected)) < mu
+        status[infected[recovering]] = REC
+        status[new_inf] = INF
+        infected = np.concatenate([infected[~recovering], new_inf])
+
+        S.append(S[-1] - len(new_inf))
+        I.append(len(infected))
+        R.append(R[-1] + int(np.count_nonzero(recovering)))
+
+        if message:
+            print(f'simulation until time t={t+1}', end='\r')
+            sys.stdout.flush()
+        if len(infected) == 0:
+            break
+
+    if not isinstance(G, tuple):
+        nx.set_node_attributes(G, {i: int(status[i]) for i in range(N)}, 'inf_status')
+    return np.array(time), np.array(S), np.array(I), np.array(R)
+
+
+def write_back(G, NET, status, aware, got_infected, u=None, v=None):
+    """Store the final states (and the rewired edges, if given) into the
+    networkx graphs, so callers can keep using them as with utils.SIR_net_adaptive"""
+    N = len(status)
+    labels = STATUS_LABELS[status]
+    inf_status = {i: labels[i] for i in range(N)}
+    nx.set_node_attributes(G, inf_status, 'inf_status')
+    nx.set_node_attributes(G, inf_status, 'new_inf_status')
+    nx.set_node_attributes(G, {i: int(got_infected[i]) for i in range(N)}, 'got_infected')
+    aware_status = {i: int(aware[i]) for i in range(N)}
+    nx.set_node_attributes(NET, aware_status, 'aware_status')
+    nx.set_node_attributes(NET, aware_status, 'new_aware_status')
+    if u is not None:
+        NET.remove_edges_from(list(NET.edges()))
+        NET.add_edges_from(zip(u.tolist(), v.tolist()))
+
+
+def SIR_net_adaptive_csr(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), message=True, opinions=False, clustering=False, profile=None, progress=None):
+    """
+    Array-backed engine with the same signature and return values of
+    utils.SIR_net_adaptive.
+    G: physical network
+    NET: information network (initialized with initNET_rnd or initNET_SI),
+    beta: infection rate,
+    mu: recovery rate,
+    r: rate of vaccination for PV,
+    pro: rate of classical media influence on people,
+    pol: propensity of opinion polarization,
+    initial_infecteds: list of infected nodes at time t=0,
+    rewiring: whether the information network should be static or dynamic,
+    opinions: if True, the NV and PV time series are appended to the outputs,
+    clustering: if True, so is the average clustering coefficient of the
+    information network at every time step,
+    profile: optional profiling.PhaseProfile (see utils.SIR_net_adaptive),
+    progress: optional callable progress(t, infectious) called after every
+    time step (see telemetry.py)
+
+    The infection of a susceptible node with k infectious neighbours happens
+    with probability 1 - (1 - beta)^k, which is the same law as the
+    neighbour by neighbour coin flips of the reference implementation.
+    At the end the final states (and the rewired information network) are
+    written back into G and NET."""
+
+    u_info, v_info = graph_edges(NET)
+    outputs, status, aware, got_infected, u_info, v_info = SIR_adaptive_arrays(
+        graph_to_csr(G), u_info, v_info, node_attribute_array(NET, 'aware_status'),
+        beta, mu, r, pro, pol, initial_infecteds, rewiring=rewiring, rng=rng, message=message, opinions=opinions, clustering=clustering, profile=profile, progress=progress)
+    if rewiring:
+        write_back(G, NET, status, aware, got_infected, u_info, v_info)
+    else:
+        write_back(G, NET, status, aware, got_infected)
+    return outputs
+
+
+def SIR_adaptive_arrays(csr, u_info, v_info, aware, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), message=True, opinions=False, clustering=False, profile=None, progress=None):
+    """
+    Core of SIR_net_adaptive_csr working on arrays only (no networkx):
+    csr: CSR adjacency (indptr, indices) of the physical network (it is only read,
+    so it can live in shared memory),
+    u_info, v_info: edges of the information network (a private copy is rewired),
+    aware: initial opinions (0 = pro vax, 1 = no vax),
+    the other arguments as in SIR_net_adaptive.
+    Returns the outputs of SIR_net_adaptive and the final infectious status,
+    opinions, got_infected flags and information network edges."""
+
+    N = len(csr[0]) - 1
+
+    # physical layer (static)
+    phys = csr_matrix(*csr)
+
+    # information layer: edge list + CSR, rebuilt only after a rewiring
+    info_indptr, info_indices = edges_to_csr(N, u_info, v_info)
+    aware = np.array(aware, dtype=np.int8)
+
+    #INITIALIZATION
+    status = np.full(N, SUS, dtype=np.int8)
+    status[np.asarray(initial_infecteds, dtype=np.int64)] = INF
+    got_infected = status == INF
+
+    time = [0]
+    S = [N - int(np.count_nonzero(status == INF))]
+    I = [N - S[0]]
+    R = [0]
+    V = [0]
+    NV = [int(np.count_nonzero(aware))]     # no vax
+
+    # How many people did change idea?
+    tracker = FlipTracker(N)
+    changers = [0]
+    bichangers = [0]
+
+    # clustering of the information network: the triangles through every node
+    # are updated from the edges changed by the rewiring
+    if clustering:
+        triangles = node_triangles(info_indptr, info_indices)
+        cc = clustering_from_triangles(info_indptr, triangles)
+        CC = [cc]
+
+    t = 0
+    while True:
+        t += 1
+        time.append(t)
+        if profile is not None:
+            profile.step()
+
+        # REWIRING OF THE INFORMATION NETWORK
+        if rewiring:
+            if profile is not None:
+                discordant = np.count_nonzero(aware[u_info] != aware[v_info])
+            new_u, new_v, rewires = rewire_edges(N, u_info, v_info, aware, pol, rng)
+            if new_u is not u_info:
+                old = (info_indptr, info_indices, edge_keys(N, u_info, v_info))
+                u_info, v_info = new_u, new_v
+                info_indptr, info_indices = edges_to_csr(N, u_info, v_info)
+                if clustering:
+                    triangles = update_triangles(triangles, old, (info_indptr, info_indices, edge_keys(N, u_info, v_info)), N)
+                    cc = clustering_from_triangles(info_indptr, triangles)
+        if clustering:
+            CC.append(cc)
+        if profile is not None:
+            profile.lap('rewiring')
+            if rewiring:
+                profile.count(discordant_edges=discordant, rewires=rewires)
+
+        # EPIDEMICS IN THE PHYSICAL NETWORK
+        new_status = status.copy()
+        susceptible = status == SUS
+
+        # provax that get vaccinated
+        candidates = np.flatnonzero(susceptible & (aware == PROVAX))
+        new_status[candidates[rng.random(len(candidates)) < r]] = VAX
+
+        # infectious that recover
+        infectious = np.flatnonzero(status == INF)
+        new_status[infectious[rng.random(len(infectious)) < mu]] = REC
+
+        # susceptible that get the disease (this overrides the vaccination, as in utils.py)
+        k_inf = phys.dot((status == INF).astype(np.int32))
+        exposed = np.flatnonzero(susceptible & (k_inf > 0))
+        p_inf = 1. - (1. - beta) ** k_inf[exposed]
+        new_inf = exposed[rng.random(len(exposed)) < p_inf]
+        new_status[new_inf] = INF
+        got_infected[new_inf] = True
+        if profile is not None:
+            profile.lap('infection')
+            # the sparse product scans every edge once; one number per exposed susceptible
+            profile.count(edges_scanned=phys.nnz, infection_attempts=len(exposed))
+
+        # EPIDEMICS IN THE INFORMATION NETWORK
+        new_aware = aware.copy()
+        media = rng.random(N) < pro
+        new_aware[media] = PROVAX                                   # become a pro vax due to classical media
+        deg = info_indptr[1:] - info_indptr[:-1]
+        voters = np.flatnonzero(~media & (status != VAX) & (deg > 0))
+        targets = random_neighbors(info_indptr, info_indices, voters, rng)
+        new_aware[voters] = aware[targets]                          # can become a pro/no vax via neighbours
+
+        n_changers, n_bichangers = tracker.update(new_aware != aware)
+        changers.append(int(n_changers))
+        bichangers.append(int(n_bichangers))
+        if profile is not None:
+            profile.lap('voter')
+            profile.count(opinion_copies=len(voters), media=np.count_nonzero(media))
+
+        # UPDATE NETWORKS
+        status = new_status
+        aware = new_aware
+        if profile is not None:
+            profile.lap('update')
+
+        # COMPUTE THE TOTAL NUMBER OF SUSCEPTIBLE, INFECTED AND RECOVERED PEOPLE
+        suscep, infect, recov, vaccin = np.bincount(status, minlength=4)
+        S.append(int(suscep))
+        I.append(int(infect))
+        R.append(int(recov))
+        V.append(int(vaccin))
+        NV.append(int(np.count_nonzero(aware)))
+        if profile is not None:
+            profile.lap('count')
+
+        # end simulation if no more infectious are present
+        if message:
+            print(f'simulation until time t={t+1}', end='\r')
+            sys.stdout.flush()
+        if progress is not None:
+            progress(t, int(infect))
+        if infect == 0:
+            break
+
+    total_infected = int(np.count_nonzero(got_infected))
+    outputs = (np.array(time), np.array(S), np.array(I), np.array(R), np.array(V), total_infected, changers, bichangers)
+    if opinions:
+        outputs += (np.array(NV), N - np.array(NV))
+    if clustering:
+        outputs += (np.array(CC),)
+    return outputs, status, aware, got_infected, u_info, v_info
+
+
+def SIR_net_adaptive_batch(G, aware, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), NET=None, message=True, opinions=False, progress=None):
+    """
+    Run M replicas of SIR_net_adaptive_csr together on the same physical network.
+    G: physical network, shared by all the replicas (networkx graph or CSR (indptr, indices) tuple)
+    aware: (M, N) array with the initial opinion of every node in every replica (0 = pro vax, 1 = no vax),
+    beta, mu, r, pro, pol, rewiring: as in SIR_net_adaptive,
+    initial_infecteds: one list of infected nodes at time t=0 for every replica,
+    NET: initial structure of the information network (default: a copy of G),
+    rng: Generator shared by the replicas, or a list of M Generators: every
+    replica then draws from its own stream and gets the same results in a
+    batch of any size (see uniforms),
+    opinions: if True, the NV and PV time series are appended to the outputs,
+    progress: optional callable progress(t, infectious) called after every
+    time step with the infectious of all the running replicas
+
+    The states are kept as (M, N) matrices, so one sparse product per step
+    gives the infectious neighbours of every node in every replica. With
+    rewiring, the information networks of the replicas are stored as one
+    graph over M*N nodes (node i of replica m is m*N + i). Replicas whose
+    epidemic is over leave the batch.
+    Returns the list of the M result tuples of SIR_net_adaptive (in the
+    input order) and the list of the M final information networks as edge
+    arrays (u, v)."""
+
+    aware = np.array(aware, dtype=np.int8)
+    M, N = aware.shape
+
+    csr = G if isinstance(G, tuple) else graph_to_csr(G)
+    phys = csr_matrix(*csr)
+    if NET is not None:
+        u0, v0 = graph_edges(NET)
+    else:
+        u0, v0 = csr_edges(*csr)
+    info_indptr, info_indices = edges_to_csr(N, u0, v0)
+    if rewiring:
+        # one disconnected copy of the information network per replica
+        shift = np.repeat(np.arange(M, dtype=np.int64) * N, len(u0))
+        u_info = np.tile(u0, M) + shift
+        v_info = np.tile(v0, M) + shift
+        info_indptr, info_indices = edges_to_csr(M * N, u_info, v_info)
+
+    #INITIALIZATION
+    status = np.full((M, N), SUS, dtype=np.int8)
+    for m in range(M):
+        status[m, np.asarray(initial_infecteds[m], dtype=np.int64)] = INF
+    got_infected = status == INF
+    tracker = FlipTracker((M, N))
+    replica = np.arange(M)                       # input index of every row still in the batch
+
+    n_inf = np.count_nonzero(status == INF, axis=1)
+    time = [[0] for _ in range(M)]
+    S = [[N - int(n_inf[m])] for m in range(M)]
+    I = [[int(n_inf[m])] for m in range(M)]
+    R = [[0] for _ in range(M)]
+    V = [[0] for _ in range(M)]
+    NV = [[int(x)] for x in np.count_nonzero(aware, axis=1)]
+    changers = [[0] for _ in range(M)]
+    bichangers = [[0] for _ in range(M)]
+    results = [None] * M
+    info_edges = [(u0, v0)] * M
+
+    t = 0
+    while len(replica) > 0:
+        t += 1
+        rows = len(replica)
+
+        # REWIRING OF THE INFORMATION NETWORKS
+        if rewiring:
+            new_u, new_v, _ = rewire_edges(rows * N, u_info, v_info, aware.ravel(), pol, rng, block=N)
+            if new_u is not u_info:
+                u_info, v_info = new_u, new_v
+                info_indptr, info_indices = edges_to_csr(rows * N, u_info, v_info)
+
+        # EPIDEMICS IN THE PHYSICAL NETWORK
+        new_status = status.copy()
+        susceptible = status == SUS
+        flat_new = new_status.ravel()
+
+        candidates = np.flatnonzero(susceptible & (aware == PROVAX))
+        flat_new[candidates[uniforms(rng, candidates, N) < r]] = VAX
+
+        infectious = np.flatnonzero(status == INF)
+        flat_new[infectious[uniforms(rng, infectious, N) < mu]] = REC
+
+        k_inf = np.asarray(phys.dot((status == INF).T.astype(np.int32))).T
+        exposed = np.flatnonzero(susceptible & (k_inf > 0))
+        p_inf = 1. - (1. - beta) ** k_inf.ravel()[exposed]
+        new_inf = exposed[uniforms(rng, exposed, N) < p_inf]
+        flat_new[new_inf] = INF
+        got_infected.ravel()[new_inf] = True
+
+        # EPIDEMICS IN THE INFORMATION NETWORKS
+        new_aware = aware.copy()
+        media = uniforms(rng, np.arange(rows * N), N).reshape(rows, N) < pro
+        new_aware[media] = PROVAX
+        if rewiring:
+            deg = (info_indptr[1:] - info_indptr[:-1]).reshape(rows, N)
+        else:
+            deg = np.broadcast_to(info_indptr[1:] - info_indptr[:-1], (rows, N))
+        voters = np.flatnonzero(~media & (status != VAX) & (deg > 0))
+        u = uniforms(rng, voters, N)
+        if rewiring:
+            targets = random_neighbors(info_indptr, info_indices, voters, rng, u)
+        else:
+            targets = random_neighbors(info_indptr, info_indices, voters % N, rng, u) + voters - voters % N
+        new_aware.ravel()[voters] = aware.ravel()[targets]
+
+        n_changers, n_bichangers = tracker.update(new_aware != aware)
+
+        # UPDATE NETWORKS
+        status = new_status
+        aware = new_aware
+
+        # COMPUTE THE COMPARTMENTS OF EVERY REPLICA
+        counts = np.stack([np.count_nonzero(status == c, axis=1) for c in (SUS, INF, REC, VAX)], axis=1)
+        n_novax = np.count_nonzero(aware, axis=1)
+        for row, m in enumerate(replica):
+            time[m].append(t)
+            S[m].append(int(counts[row, SUS]))
+            I[m].append(int(counts[row, INF]))
+            R[m].append(int(counts[row, REC]))
+            V[m].append(int(counts[row, VAX]))
+            NV[m].append(int(n_novax[row]))
+            changers[m].append(int(n_changers[row]))
+            bichangers[m].append(int(n_bichangers[row]))
+
+        if message:
+            print(f'simulation until time t={t+1}, {rows} replicas running', end='\r')
+            sys.stdout.flush()
+        if progress is not None:
+            progress(t, int(counts[:, INF].sum()))
+
+        # replicas with no more infectious leave the batch
+        over = counts[:, INF] == 0
+        if not over.any():
+            continue
+        if rewiring:
+            slot = u_info // N
+        for row in np.flatnonzero(over):
+            m = replica[row]
+            results[m] = (np.array(time[m]), np.array(S[m]), np.array(I[m]), np.array(R[m]), np.array(V[m]),
+                          int(np.count_nonzero(got_infected[row])), changers[m], bichangers[m])
+            if opinions:
+                results[m] += (np.array(NV[m]), N - np.array(NV[m]))
+            if rewiring:
+                mine = slot == row
+                info_edges[m] = (u_info[mine] - row * N, v_info[mine] - row * N)
+        alive = ~over
+        replica = replica[alive]
+        status = status[alive]
+        aware = aware[alive]
+        got_infected = got_infected[alive]
+        tracker.select(alive)
+        if isinstance(rng, list):
+            rng = [rng[row] for row in np.flatnonzero(alive)]
+        if rewiring:
+            new_slot = np.cumsum(alive) - 1
+            keep = alive[slot]
+            u_info = new_slot[slot[keep]] * N + u_info[keep] % N
+            v_info = new_slot[slot[keep]] * N + v_info[keep] % N
+            info_indptr, info_indices = edges_to_csr(len(replica) * N, u_info, v_info)
+
+    return results, info_edges
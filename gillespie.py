@@ -0,0 +1,408 @@
+import numpy as np
+import networkx as nx
+import math
+import sys
+from utils import IndexedSet, TriangleCounter
+
+# Event-driven (continuous time) versions of SIR_net and SIR_net_adaptive.
+# Every transition of the discrete models becomes a Poisson process whose
+# rate is the corresponding per step probability:
+#   infection      beta per S-I edge of the physical network
+#   recovery       mu per infectious node
+#   vaccination    r per susceptible pro vax node
+#   media          pro per no vax node (the node becomes pro vax)
+#   opinion copy   d/k per non vaccinated node with d discordant neighbours
+#                  out of k (copying a random neighbour at rate 1 only
+#                  changes the opinion if the neighbour disagrees)
+#   rewiring       pol per discordant edge of the information network
+# The next event is found with the Gillespie direct method, the infection
+# events with composition-rejection over the infectious nodes weighted by
+# their degree (a rejected pick, i.e. a non susceptible neighbour, is a null
+# event) and the opinion copies over the voters weighted by d/k. Media and
+# voters only draw the events that change an opinion, so the cost follows
+# the number of infections, recoveries, vaccinations and opinion changes,
+# not N times the number of steps.
+# The outputs are sampled on the integer time grid t = 0, 1, 2, ... so they
+# have the same format as the ones of the discrete time functions.
+# It is a different model, not a faster version of them: in the discrete
+# time functions all the nodes update together from the state of the
+# previous step (e.g. a node can get vaccinated and copy a no vax opinion in
+# the same step, and every discordant edge is rewired at once), here the
+# events happen one at a time and see the current state. The no vax pool
+# and the clustering of the rewired network come out much smaller (N=400,
+# r=0.05, pol=0.5: 0-10 no vax at the end against about 100).
+
+
+class UniformStream:
+    """Uniform random numbers of a np.random.Generator drawn in blocks"""
+
+    def __init__(self, rng, block=4096):
+        self.rng = rng
+        self.block = block
+        self.buffer = rng.random(block)
+        self.pos = 0
+
+    def __call__(self):
+        if self.pos == self.block:
+            self.buffer = self.rng.random(self.block)
+            self.pos = 0
+        u = self.buffer[self.pos]
+        self.pos += 1
+        return u
+
+
+class WeightedSampler:
+    """Random choice of an item with probability proportional to its (positive,
+    possibly fractional) weight, by composition-rejection: items are grouped
+    in bins of weights in [2^b, 2^(b+1)), a bin is chosen by its total weight and an item inside it
+    by rejection (acceptance probability at least 1/2)."""
+
+    def __init__(self):
+        self.bins = {}
+        self.bin_weight = {}
+        self.weight = {}
+        self.total = 0.
+
+    def __len__(self):
+        return len(self.weight)
+
+    def add(self, item, w):
+        b = math.floor(math.log2(w))
+        self.bins.setdefault(b, IndexedSet()).add(item)
+        self.bin_weight[b] = self.bin_weight.get(b, 0.) + w
+        self.weight[item] = w
+        self.total += w
+
+    def remove(self, item):
+        w = self.weight.pop(item)
+        b = math.floor(math.log2(w))
+        self.bins[b].remove(item)
+        self.bin_weight[b] -= w
+        self.total -= w
+        if not self.weight:        # no round-off left when empty
+            self.total = 0.
+            self.bin_weight = dict.fromkeys(self.bin_weight, 0.)
+
+    def set(self, item, w):
+        """Change the weight of an item (added if new, removed if w is 0)"""
+        old = self.weight.get(item)
+        if old is not None and w > 0 and math.floor(math.log2(w)) == math.floor(math.log2(old)):
+            b = math.floor(math.log2(w))         # same bin: only the weights change
+            self.bin_weight[b] += w - old
+            self.total += w - old
+            self.weight[item] = w
+            return
+        if old is not None:
+            self.remove(item)
+        if w > 0:
+            self.add(item, w)
+
+    def choice(self, uniform):
+        x = uniform() * self.total
+        for b, bw in self.bin_weight.items():
+            if len(self.bins[b]) == 0:
+                continue
+            chosen = b
+            if x < bw:
+                break
+            x -= bw
+        b = chosen                 # guards against round-off in the bin weights
+        items = self.bins[b]
+        w_max = 2. ** (b + 1)
+        while True:
+            item = items.choice(uniform())
+            if uniform() * w_max < self.weight[item]:
+                return item
+
+
+def adjacency_lists(G):
+    """Neighbour lists of a networkx graph with nodes 0..N-1"""
+    return [list(G.neighbors(i)) for i in range(G.number_of_nodes())]
+
+
+def SIR_net_gillespie(G, beta, mu, initial_infecteds, seed=123, message=True):
+    """Continuous time SIR process, same arguments and outputs of utils.SIR_net.
+    G = network, beta = infection rate, mu = recovery rate,
+    initial_infecteds = list of infected nodes at time t=0 """
+
+    uniform = UniformStream(np.random.default_rng(seed))
+    N = G.number_of_nodes()
+    adj = adjacency_lists(G)
+    status = [0] * N                         # 0 = susceptible; 1 = infectious; 2 = recovered
+    infected = IndexedSet()
+    spreaders = WeightedSampler()            # infectious nodes weighted by their degree
+    for i in set(int(i) for i in initial_infecteds):
+        status[i] = 1
+        infected.add(i)
+        if len(adj[i]) > 0:
+            spreaders.add(i, len(adj[i]))
+    counts = [N - len(infected), len(infected), 0]
+
+    time, S, I, R = [], [], [], []
+    t = 0.
+    next_grid = 0
+    while True:
+        total = mu * len(infected) + beta * spreaders.total
+        t += -math.log(1. - uniform()) / total
+        while next_grid <= t:
+            time.append(next_grid)
+            S.append(counts[0])
+            I.append(counts[1])
+            R.append(counts[2])
+            next_grid += 1
+
+        if uniform() * total < mu * len(infected):
+            # recovery
+            i = infected.choice(uniform())
+            infected.remove(i)
+            if i in spreaders.weight:
+                spreaders.remove(i)
+            status[i] = 2
+            counts[1] -= 1
+            counts[2] += 1
+        else:
+            # infection along a random edge of a spreader (null event if the neighbour is not susceptible)
+            i = spreaders.choice(uniform)
+            j = adj[i][int(uniform() * len(adj[i]))]
+            if status[j] == 0:
+                status[j] = 1
+                infected.add(j)
+                spreaders.add(j, len(adj[j]))
+                counts[0] -= 1
+                counts[1] += 1
+
+        if message:
+            print(f'simulation until time t={round(t, 1)}', end='\r')
+            sys.stdout.flush()
+        if counts[1] == 0:
+            break
+
+    # the last point of the grid has no infectious, as in SIR_net
+    time.append(next_grid)
+    S.append(counts[0])
+    I.append(counts[1])
+    R.append(counts[2])
+
+    return np.array(time), np.array(S), np.array(I), np.array(R)
+
+
+def SIR_net_adaptive_gillespie(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), message=True, opinions=False, clustering=False, progress=None):
+    """
+    Continuous time version of utils.SIR_net_adaptive, same arguments and outputs.
+    G: physical network
+    NET: information network (initialized with initNET_rnd or initNET_SI),
+    beta: infection rate,
+    mu: recovery rate,
+    r: rate of vaccination for PV,
+    pro: rate of classical media influence on people,
+    pol: propensity of opinion polarization,
+    initial_infecteds: list of infected nodes at time t=0,
+    rewiring: whether the information network should be static or dynamic,
+    opinions: if True, the NV and PV time series are appended to the outputs,
+    clustering: if True, so is the average clustering coefficient of the
+    information network on the time grid (see utils.TriangleCounter),
+    progress: optional callable progress(t, infectious) called at every point
+    of the time grid (see telemetry.py)
+
+    changers[t] counts the nodes that changed opinion in the time interval
+    (t-1, t], bichangers[t] those that changed it also in (t-2, t-1].
+    At the end the final states and the rewired information network are
+    written into G and NET."""
+
+    uniform = UniformStream(rng)
+    N = G.number_of_nodes()
+    adj = adjacency_lists(G)
+    info = [IndexedSet(NET.neighbors(i)) for i in range(N)]
+
+    #INITIALIZATION
+    # plain lists: scalar access is much faster than on NumPy arrays
+    status = ['S'] * N
+    got_infected = [False] * N
+    aware = [int(NET.nodes[i]['aware_status']) for i in range(N)]
+
+    infected = IndexedSet()
+    spreaders = WeightedSampler()
+    for i in set(int(i) for i in initial_infecteds):
+        status[i] = 'I'
+        got_infected[i] = True
+        infected.add(i)
+        if len(adj[i]) > 0:
+            spreaders.add(i, len(adj[i]))
+    provax = IndexedSet(i for i in range(N) if aware[i] == 0)
+    novax = IndexedSet(i for i in range(N) if aware[i] == 1)
+    to_vaccinate = IndexedSet(i for i in provax if status[i] == 'S')     # susceptible pro vax
+    discordant = IndexedSet()
+    n_discordant = [0] * N          # discordant neighbours in the information network
+    for a, b in NET.edges():
+        if aware[a] != aware[b]:
+            n_discordant[a] += 1
+            n_discordant[b] += 1
+            if rewiring:
+                discordant.add((min(a, b), max(a, b)))
+    voters = WeightedSampler()      # non vaccinated nodes weighted by their discordant fraction
+
+    def update_voter(i):
+        voters.set(i, n_discordant[i] / len(info[i]) if n_discordant[i] > 0 and status[i] != 'V' else 0.)
+
+    for i in range(N):
+        update_voter(i)
+    counts = {'S': N - len(infected), 'I': len(infected), 'R': 0, 'V': 0}
+    triangles = TriangleCounter(info, N) if clustering else None
+
+    last_flip = [-2] * N
+    time, S, I, R, V, NV, PV, CC = [], [], [], [], [], [], [], []
+    changers, bichangers = [], []
+    flips = [0, 0]             # changers and bichangers of the current grid interval
+
+    def flip(i, k):
+        # the opinion of node i changes during the grid interval k
+        if aware[i] == 0:
+            aware[i] = 1
+            provax.remove(i)
+            novax.add(i)
+            to_vaccinate.remove(i)
+        else:
+            aware[i] = 0
+            novax.remove(i)
+            provax.add(i)
+            if status[i] == 'S':
+                to_vaccinate.add(i)
+        for j in info[i]:
+            if aware[i] != aware[j]:
+                n_discordant[j] += 1
+                if rewiring:
+                    discordant.add((min(i, j), max(i, j)))
+            else:
+                n_discordant[j] -= 1
+                if rewiring:
+                    discordant.remove((min(i, j), max(i, j)))
+            update_voter(j)
+        n_discordant[i] = len(info[i]) - n_discordant[i]
+        update_voter(i)
+        if last_flip[i] != k:
+            flips[0] += 1
+            if last_flip[i] == k - 1:
+                flips[1] += 1
+            last_flip[i] = k
+
+    def record(k):
+        time.append(k)
+        S.append(counts['S'])
+        I.append(counts['I'])
+        R.append(counts['R'])
+        V.append(counts['V'])
+        NV.append(len(novax))
+        PV.append(len(provax))
+        if clustering:
+            CC.append(triangles.average_clustering())
+        changers.append(flips[0])
+        bichangers.append(flips[1])
+        flips[0] = flips[1] = 0
+        if progress is not None:
+            progress(k, counts['I'])
+
+    t = 0.
+    record(0)
+    next_grid = 1
+    while True:
+        rates = [mu * len(infected),
+                 beta * spreaders.total,
+                 r * len(to_vaccinate),
+                 pro * len(novax),
+                 voters.total,
+                 pol * len(discordant) if rewiring else 0.]
+        total = sum(rates)
+        t += -math.log(1. - uniform()) / total
+        while next_grid <= t:
+            record(next_grid)
+            next_grid += 1
+        k = next_grid          # the event happens in the grid interval (k-1, k]
+
+        x = uniform() * total
+        event = 0
+        while x >= rates[event] and event < len(rates) - 1:
+            x -= rates[event]
+            event += 1
+
+        if event == 0:
+            # recovery
+            i = infected.choice(uniform())
+            infected.remove(i)
+            if i in spreaders.weight:
+                spreaders.remove(i)
+            status[i] = 'R'
+            counts['I'] -= 1
+            counts['R'] += 1
+        elif event == 1:
+            # infection (null event if the chosen neighbour is not susceptible)
+            i = spreaders.choice(uniform)
+            j = adj[i][int(uniform() * len(adj[i]))]
+            if status[j] == 'S':
+                status[j] = 'I'
+                got_infected[j] = True
+                infected.add(j)
+                spreaders.add(j, len(adj[j]))
+                to_vaccinate.remove(j)
+                counts['S'] -= 1
+                counts['I'] += 1
+        elif event == 2:
+            # vaccination of a susceptible pro vax
+            i = to_vaccinate.choice(uniform())
+            to_vaccinate.remove(i)
+            status[i] = 'V'
+            update_voter(i)
+            counts['S'] -= 1
+            counts['V'] += 1
+        elif event == 3:
+            # classical media turn a no vax into a pro vax
+            flip(novax.choice(uniform()), k)
+        elif event == 4:
+            # voter model on the information network: a voter copies a discordant neighbour
+            flip(voters.choice(uniform), k)
+        else:
+            # rewiring of a discordant edge
+            a, b = discordant.choice(uniform())
+            discordant.remove((a, b))
+            info[a].remove(b)
+            info[b].remove(a)
+            n_discordant[a] -= 1
+            n_discordant[b] -= 1
+            if clustering:
+                triangles.edge_changed(a, b, -1)
+            nv, pv = (a, b) if aware[a] == 1 else (b, a)
+            for i, pool in ((nv, novax), (pv, provax)):
+                j = pool.choice(uniform())
+                if j != i and j not in info[i]:
+                    info[i].add(j)
+                    info[j].add(i)
+                    if clustering:
+                        triangles.edge_changed(i, j, +1)
+                    update_voter(j)       # a concordant edge: only the degree changes
+            update_voter(a)
+            update_voter(b)
+
+        if message:
+            print(f'simulation until time t={round(t, 1)}', end='\r')
+            sys.stdout.flush()
+        if counts['I'] == 0:
+            break
+
+    record(next_grid)
+    total_infected = sum(got_infected)
+
+    # write the final state into the networkx graphs
+    nx.set_node_attributes(G, {i: status[i] for i in range(N)}, 'inf_status')
+    nx.set_node_attributes(G, {i: status[i] for i in range(N)}, 'new_inf_status')
+    nx.set_node_attributes(G, {i: int(got_infected[i]) for i in range(N)}, 'got_infected')
+    nx.set_node_attributes(NET, {i: int(aware[i]) for i in range(N)}, 'aware_status')
+    nx.set_node_attributes(NET, {i: int(aware[i]) for i in range(N)}, 'new_aware_status')
+    if rewiring:
+        NET.remove_edges_from(list(NET.edges()))
+        NET.add_edges_from((i, j) for i in range(N) for j in info[i] if i < j)
+
+    outputs = (np.array(time), np.array(S), np.array(I), np.array(R), np.array(V), total_infected, changers, bichangers)
+    if opinions:
+        outputs += (np.array(NV), np.array(PV))
+    if clustering:
+        outputs += (np.array(CC),)
+    return outputs
@@ -0,0 +1,213 @@
+import numpy as np
+import networkx as nx
+import os
+from multiprocessing import shared_memory
+from fast_utils import edges_to_csr, canonical_edges
+
+# Networks stored as arrays (CSR adjacency, see fast_utils.py) that can be
+# shared between processes or cached on disk.
+
+
+def share_arrays(**arrays):
+    """Copy the given arrays into shared memory blocks.
+    Returns the blocks (the creator must close and unlink them at the end)
+    and a small picklable spec to attach to them with attach_arrays."""
+    blocks = []
+    spec = {}
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[...] = a
+        blocks.append(block)
+        spec[name] = (block.name, a.shape, a.dtype.str)
+    return blocks, spec
+
+
+# blocks attached by this process (kept referenced, otherwise the mappings are closed)
+_attached = []
+
+
+def attach_arrays(spec):
+    """Zero-copy, read-only views of the arrays described by spec (see share_arrays)"""
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _attached.append(block)
+        a = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        a.flags.writeable = False
+        arrays[name] = a
+    return arrays
+
+
+def release(blocks):
+    """Close and unlink the blocks created by share_arrays"""
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def share_csr(indptr, indices):
+    """Place a CSR adjacency in shared memory, see share_arrays"""
+    return share_arrays(indptr=indptr, indices=indices)
+
+
+def attach_csr(spec):
+    """(indptr, indices) views of a CSR adjacency placed with share_csr"""
+    arrays = attach_arrays(spec)
+    return arrays['indptr'], arrays['indices']
+
+
+# Native generators: the edges (u < v, sorted) of random graphs drawn with a
+# np.random.Generator, without building a networkx graph. edges_to_csr gives
+# the CSR adjacency, fast_utils.csr_to_graph the graph for the functions of utils.py.
+
+
+def resolve_copies(dst, ptr):
+    """Node of every edge slot of the Batagelj-Brandes sampler: dst holds the
+    known nodes and -1 where the slot copies the slot ptr (an earlier one)"""
+    dst = dst.copy()
+    ptr = ptr.copy()
+    todo = np.flatnonzero(dst < 0)
+    while len(todo):
+        q = ptr[todo]
+        known = dst[q] >= 0
+        dst[todo[known]] = dst[q[known]]
+        ptr[todo[~known]] = ptr[q[~known]]          # pointer jumping
+        todo = todo[~known]
+    return dst
+
+
+def barabasi_albert_edges(N, m, rng):
+    """Barabasi-Albert graph, as nx.barabasi_albert_graph: a star of m + 1
+    nodes, then every new node links to m distinct nodes chosen with
+    probability proportional to their degree.
+    The preferential choice is the one of Batagelj and Brandes: the target of
+    an edge is a uniform element of the list of the endpoints of the earlier
+    edges, i.e. the source of an earlier edge (known) or a copy of its target.
+    The copies are resolved for all the edges at once; the edges that repeat
+    a target of the same node are drawn again, until there are none."""
+    if m < 1 or m >= N:
+        raise ValueError(f'Barabasi-Albert network must have m >= 1 and m < N, m = {m}, N = {N}')
+    E = m * (N - m)
+    e = np.arange(E, dtype=np.int64)
+    src = np.where(e < m, 0, m + 1 + (e - m) // m)
+    first = np.where(e < m, 0, m + (src - m - 1) * m)          # first edge of the source node
+    known = np.where(e < m, e + 1, -1)                          # the star
+    ptr = np.zeros(E, dtype=np.int64)
+    dst = known
+    redraw = e[m:]
+    while len(redraw):
+        slot = (rng.random(len(redraw)) * 2 * first[redraw]).astype(np.int64)
+        end = slot % 2 == 0
+        known[redraw] = np.where(end, src[slot // 2], -1)
+        ptr[redraw] = slot // 2
+        dst = resolve_copies(known, ptr)
+        # a row of m edges per new node: the repetitions of a target after its first edge
+        targets = dst[m:].reshape(-1, m)
+        order = np.argsort(targets, axis=1, kind='stable')
+        ordered = np.take_along_axis(targets, order, axis=1)
+        repeated = np.zeros(targets.shape, dtype=bool)
+        np.put_along_axis(repeated, order[:, 1:], ordered[:, 1:] == ordered[:, :-1], axis=1)
+        redraw = m + np.flatnonzero(repeated)
+    return canonical_edges(N, src, dst)
+
+
+def erdos_renyi_edges(N, p, rng):
+    """G(N, p) graph: the number of edges is binomial, the edges are distinct
+    uniform pairs (drawn in blocks and deduplicated until there are enough)"""
+    E = int(rng.binomial(N * (N - 1) // 2, p))
+    keys = np.zeros(0, dtype=np.int64)
+    while len(keys) < E:
+        n = int(1.1 * (E - len(keys))) + 16
+        u, v = rng.integers(N, size=(2, n), dtype=np.int64)
+        keep = u != v
+        new = np.minimum(u, v)[keep] * N + np.maximum(u, v)[keep]
+        keys = np.concatenate([keys, new])
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]                 # keep the order of the draws
+    keys = np.sort(keys[:E])
+    return keys // N, keys % N
+
+
+def configuration_model_edges(degrees, rng):
+    """Configuration model with the given degree sequence, as
+    nx.Graph(nx.configuration_model(degrees)): the stubs are matched at
+    random, then self-loops and multi-edges are dropped (so the hubs may end
+    up with a slightly smaller degree)"""
+    degrees = np.asarray(degrees, dtype=np.int64)
+    if degrees.sum() % 2 or (degrees < 0).any():
+        raise ValueError('Invalid degree sequence: the sum of the degrees must be even and the degrees non negative')
+    stubs = rng.permutation(np.repeat(np.arange(len(degrees), dtype=np.int64), degrees))
+    return canonical_edges(len(degrees), stubs[0::2], stubs[1::2])
+
+
+def edge_array(u, v):
+    return np.stack([u, v], axis=1).astype(np.int32)
+
+
+# Generators of the cached networks: name -> function (N, m, seed) returning the edges as an (E, 2) array.
+# 'barabasi_albert' is the networkx generator of the first caches; the native ones have the
+# same number of edges per node, m (the Erdos-Renyi graph has average degree 2m).
+generators = {
+    'barabasi_albert': lambda N, m, seed: np.array(nx.barabasi_albert_graph(N, m, seed=seed).edges(), dtype=np.int32).reshape(-1, 2),
+    'barabasi_albert_native': lambda N, m, seed: edge_array(*barabasi_albert_edges(N, m, np.random.default_rng(seed))),
+    'erdos_renyi_native': lambda N, m, seed: edge_array(*erdos_renyi_edges(N, 2 * m / (N - 1), np.random.default_rng(seed))),
+}
+
+
+class NetworkCache:
+    """On-disk cache of generated networks, stored as .npy edge arrays
+    (memory-mappable) keyed by (generator, N, m, seed).
+    When the files exceed max_bytes the least recently used ones are deleted.
+    A sweep that asks for the networks of seeds 0, 1, 2, ... gets the same
+    ensemble every time, so different sweeps are paired on the same graphs
+    (common random numbers) and the graphs are generated only once."""
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, generator, N, m, seed):
+        return os.path.join(self.directory, f'{generator}_N{N}_m{m}_seed{seed}.npy')
+
+    def edges(self, generator, N, m, seed):
+        """(E, 2) edge array of the network, generated and stored if not cached yet"""
+        path = self.path(generator, N, m, seed)
+        try:
+            edges = np.load(path, mmap_mode='r')
+            os.utime(path)                       # most recently used
+            return edges
+        except FileNotFoundError:
+            pass
+        edges = generators[generator](N, m, seed)
+        tmp = f'{path}.tmp{os.getpid()}.npy'
+        np.save(tmp, edges)
+        os.replace(tmp, path)
+        self.evict()
+        return edges
+
+    def csr(self, generator, N, m, seed):
+        """CSR adjacency (indptr, indices) of the network"""
+        edges = self.edges(generator, N, m, seed)
+        return edges_to_csr(N, np.asarray(edges[:, 0], dtype=np.int64), np.asarray(edges[:, 1], dtype=np.int64))
+
+    def evict(self):
+        """Delete the least recently used networks until the cache fits in max_bytes"""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and '.tmp' not in name:
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:     # evicted by another process
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
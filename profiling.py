@@ -0,0 +1,70 @@
+import numpy as np
+import time
+
+# Optional instrumentation of the simulation kernels (SIR_net_adaptive and
+# SIR_net_adaptive_csr take profile=PhaseProfile()). With profile=None the
+# kernels only pay one `is not None` test per phase and step.
+
+
+class PhaseProfile:
+    """Wall time and operation counts of the phases of a simulation, per time step.
+    The kernels call step() at the beginning of every time step, lap(phase)
+    at the end of each phase and count(name=value, ...) for the operations of
+    the phase; the time spent counting is not charged to any phase."""
+
+    def __init__(self):
+        self.steps = 0
+        self.times = {}        # phase -> seconds at every step
+        self.counts = {}       # operation -> count at every step
+        self.clock = 0.
+
+    def step(self):
+        self.steps += 1
+        self.clock = time.perf_counter()
+
+    def _row(self, table, name, zero):
+        row = table.setdefault(name, [])
+        row.extend([zero] * (self.steps - len(row)))      # steps in which the phase did not run
+        return row
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self._row(self.times, phase, 0.)[-1] += now - self.clock
+        self.clock = now
+
+    def count(self, **counts):
+        for name, value in counts.items():
+            self._row(self.counts, name, 0)[-1] += int(value)
+        self.clock = time.perf_counter()
+
+    def arrays(self):
+        """Per step arrays of the times and of the counts (phase or operation -> array)"""
+        return ({phase: np.array(self._row(self.times, phase, 0.)) for phase in self.times},
+                {name: np.array(self._row(self.counts, name, 0)) for name in self.counts})
+
+    def totals(self):
+        """Totals over the steps, a small picklable dict (see add_totals)"""
+        return {'runs': 1,
+                'steps': self.steps,
+                'seconds': {phase: float(sum(row)) for phase, row in self.times.items()},
+                'counts': {name: int(sum(row)) for name, row in self.counts.items()}}
+
+
+def add_totals(total, totals):
+    """Add the totals of a run (PhaseProfile.totals) to total, in place; total may be empty"""
+    total['runs'] = total.get('runs', 0) + totals['runs']
+    total['steps'] = total.get('steps', 0) + totals['steps']
+    for table in ('seconds', 'counts'):
+        row = total.setdefault(table, {})
+        for name, value in totals[table].items():
+            row[name] = row.get(name, 0) + value
+    return total
+
+
+def report(total):
+    """One line summary of aggregated totals: share of time and operations per step"""
+    seconds = sum(total['seconds'].values()) or 1.
+    steps = max(total['steps'], 1)
+    phases = ', '.join(f'{phase} {value / seconds:.0%}' for phase, value in sorted(total['seconds'].items(), key=lambda x: -x[1]))
+    counts = ', '.join(f'{name} {value / steps:.1f}' for name, value in total['counts'].items())
+    return f'{phases} | per step: {counts}'
@@ -0,0 +1,70 @@
+import numpy as np
+
+# Adaptive (quadtree) refinement of the (r, pol) grid.
+# The cells live on a fine lattice: the n0 x n0 points of a coarse grid
+# refined `depth` times (every refinement halves the spacing). The sweep
+# starts from the squares of the coarse grid and splits into 4 the squares
+# whose corners differ the most (attack rate, clustering, ...), until no
+# square changes by more than a threshold or the budget of cells is spent.
+# Cells are (i, j) indices of the lattice, as in checkpoint.Sweep.
+
+
+def lattice(lo, hi, n0, depth):
+    """Values of the finest grid between lo and hi"""
+    return np.linspace(lo, hi, (n0 - 1) * 2**depth + 1)
+
+
+def corners(square):
+    i, j, size = square
+    return [(i, j), (i + size, j), (i, j + size), (i + size, j + size)]
+
+
+def children(square):
+    i, j, size = square
+    half = size // 2
+    return [(i, j, half), (i + half, j, half), (i, j + half, half), (i + half, j + half, half)]
+
+
+class QuadTree:
+    """Leaves of the refinement of an n0 x n0 grid, at most `depth` times"""
+
+    def __init__(self, n0, depth):
+        size = 2**depth
+        self.leaves = [(i, j, size) for i in range(0, (n0 - 1) * size, size) for j in range(0, (n0 - 1) * size, size)]
+
+    def cells(self):
+        """The corners of all the leaves, i.e. the cells to simulate"""
+        return sorted(set(cell for square in self.leaves for cell in corners(square)))
+
+    def scores(self, values):
+        """Variation of every leaf: largest difference between its corners,
+        for each metric as a fraction of the range of that metric over all
+        the cells (values: cell -> array of metrics)"""
+        known = np.array([values[cell] for cell in self.cells()])
+        span = known.max(axis=0) - known.min(axis=0)
+        span[span == 0] = 1.
+        scores = {}
+        for square in self.leaves:
+            x = np.array([values[cell] for cell in corners(square)])
+            scores[square] = float(((x.max(axis=0) - x.min(axis=0)) / span).max())
+        return scores
+
+    def refine(self, values, threshold, budget):
+        """Split the leaves that vary more than threshold, the most varying
+        first, as long as the total number of cells stays within budget.
+        Returns the new cells to simulate (empty when the refinement is over)."""
+        known = set(self.cells())
+        scores = self.scores(values)
+        new = set()
+        for square in sorted(self.leaves, key=lambda s: -scores[s]):
+            if scores[square] <= threshold:
+                break
+            if square[2] == 1:
+                continue
+            cells = set(cell for child in children(square) for cell in corners(child)) - known - new
+            if len(known) + len(new) + len(cells) > budget:
+                continue
+            new |= cells
+            self.leaves.remove(square)
+            self.leaves += children(square)
+        return sorted(new)
@@ -0,0 +1,218 @@
+import numpy as np
+import json
+import os
+import shutil
+from checkpoint import atomic_write
+
+# Columnar binary results of the sweeps.
+# Every cell is stored as NumPy arrays written in bulk:
+#   <name>.scalars.npy       one row per net_type with r, pol, nsim, T and the
+#                            statistics of ar, cc, V_tot (columns ar_mean, ar_std, ...)
+#   <name>.<net_type>.npy    the time series, one row per time step with columns
+#                            time, I_mean, I_std (and I_q<q> for the quantiles)
+# A results store is a directory with all the cells:
+#   cells.npy                the concatenated scalar rows (the index of the store)
+#   series/<name>.<net_type>.npy
+#   profile.json             phase profiles of the cells (if the sweep was profiled)
+# The .npy files are uncompressed, so a single cell can be memory-mapped
+# (np.load(..., mmap_mode='r')) without reading anything else.
+
+SCALARS = ('ar', 'cc', 'V_tot')
+
+
+def scalar_dtype(kinds):
+    return np.dtype([('i', 'i4'), ('j', 'i4'), ('r', 'f8'), ('pol', 'f8'), ('net_type', 'U8'), ('nsim', 'i4'), ('T', 'i4')]
+                    + [(f'{f}_{kind}', 'f8') for kind in kinds for f in SCALARS])
+
+
+def series_dtype(kinds):
+    return np.dtype([('time', 'i4')] + [(f'I_{kind}', 'f8') for kind in kinds])
+
+
+def kinds_of(series):
+    """Statistics stored in a series array: 'mean', 'std', 'q0.5', ..."""
+    return [name[2:] for name in series.dtype.names if name.startswith('I_')]
+
+
+def save_npy(path, a):
+    """np.save, atomically"""
+    tmp = f'{path}.tmp{os.getpid()}.npy'
+    np.save(tmp, a)
+    os.replace(tmp, path)
+
+
+def save_cell(directory, name, scalars, series):
+    """Write the arrays of one cell (scalars: structured array, series: dict net_type -> structured array)"""
+    for net_type, a in series.items():
+        save_npy(os.path.join(directory, f'{name}.{net_type}.npy'), a)
+    save_npy(os.path.join(directory, f'{name}.scalars.npy'), scalars)
+
+
+def load_cell(directory, name, mmap=True):
+    """The scalars and series of one cell written by save_cell"""
+    mode = 'r' if mmap else None
+    scalars = np.load(os.path.join(directory, f'{name}.scalars.npy'))
+    series = {str(net): np.load(os.path.join(directory, f'{name}.{net}.npy'), mmap_mode=mode) for net in scalars['net_type']}
+    return scalars, series
+
+
+def csv_rows(scalars, series):
+    """The rows of one cell in the CSV format of the sweeps
+    (time,I,pol,r,ar,cc,V_tot,kind,net_type)"""
+    lines = []
+    for row in scalars:
+        net = str(row['net_type'])
+        s = series[net]
+        kinds = kinds_of(s)
+        pol, r = round(float(row['pol']), 1), round(float(row['r']), 1)
+        for k in range(len(s)):
+            for kind in kinds:
+                lines.append(f"{s['time'][k]},{round(float(s['I_' + kind][k]), 2)},{pol},{r},{int(row['ar_' + kind])},"
+                             f"{round(float(row['cc_' + kind]), 3)},{float(row['V_tot_' + kind])},{kind},{net}\n")
+    return ''.join(lines)
+
+
+def write_csv(cells, output, header):
+    """CSV file with the cells [(directory, name), ...]"""
+    atomic_write(output, header + '\n' + ''.join(csv_rows(*load_cell(directory, name, mmap=False)) for directory, name in cells))
+
+
+def write_store(cells, output):
+    """Results store (see above) in the directory output with the cells [(directory, name), ...]"""
+    os.makedirs(os.path.join(output, 'series'), exist_ok=True)
+    index = []
+    profiles = {}
+    for directory, name in cells:
+        if os.path.exists(os.path.join(directory, f'{name}.profile.json')):
+            with open(os.path.join(directory, f'{name}.profile.json')) as f:
+                profiles[name] = json.load(f)
+        scalars = np.load(os.path.join(directory, f'{name}.scalars.npy'))
+        for net in scalars['net_type']:
+            target = os.path.join(output, 'series', f'{name}.{net}.npy')
+            shutil.copyfile(os.path.join(directory, f'{name}.{net}.npy'), target + '.tmp')
+            os.replace(target + '.tmp', target)
+        index.append(scalars)
+    if profiles:
+        atomic_write(os.path.join(output, 'profile.json'), json.dumps(profiles, indent=1))
+    # the index is written last: readers only see complete cells
+    save_npy(os.path.join(output, 'cells.npy'), np.concatenate(index) if index else np.zeros(0, scalar_dtype(['mean', 'std'])))
+
+
+def load_store(store):
+    """The index (scalar rows of all the cells) of a results store"""
+    return np.load(os.path.join(store, 'cells.npy'))
+
+
+def load_series(store, i, j, net_type, mmap=True):
+    """Time series of cell (i, j) of a results store, memory-mapped by default"""
+    return np.load(os.path.join(store, 'series', f'cell_{i}_{j}.{net_type}.npy'), mmap_mode='r' if mmap else None)
+
+
+def key(x):
+    """Grid coordinate used for lookups (np.arange gives 0.30000000000000004, the CSV 0.3)"""
+    return round(float(x), 6)
+
+
+def csv_cells(path):
+    """The (scalars, series) arrays of a CSV file written by the sweeps (also
+    the older ones, without V_tot). series is keyed by (i, j, net_type)."""
+    data = np.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='utf-8')
+    metrics = [f for f in data.dtype.names if f not in ('time', 'I', 'pol', 'r', 'kind', 'net_type')]
+    kinds = list(dict.fromkeys(str(kind) for kind in data['kind']))
+    r_list = sorted(set(key(r) for r in data['r']))
+    pol_list = sorted(set(key(pol) for pol in data['pol']))
+    # one pass: the rows sorted by cell, then by time (stable, the kinds stay in file order)
+    cells = np.array([(r_list.index(key(r)), pol_list.index(key(pol)), str(net)) for r, pol, net in zip(data['r'], data['pol'], data['net_type'])],
+                     dtype=[('i', 'i4'), ('j', 'i4'), ('net_type', 'U8')])
+    order = np.lexsort((data['time'], cells['net_type'], cells['j'], cells['i']))
+    data, cells = data[order], cells[order]
+    bounds = np.flatnonzero(cells[1:] != cells[:-1]) + 1
+    scalars = np.zeros(len(bounds) + 1, dtype=scalar_dtype(kinds))
+    series = {}
+    for n, (a, b) in enumerate(zip(np.r_[0, bounds], np.r_[bounds, len(data)])):
+        rows = data[a:b]
+        i, j, net = cells[a]
+        row = scalars[n:n + 1]
+        row['i'], row['j'], row['r'], row['pol'] = i, j, r_list[i], pol_list[j]
+        row['net_type'], row['nsim'] = net, 0          # nsim is not in the CSV
+        s = None
+        for kind in kinds:
+            x = rows[rows['kind'] == kind]
+            if s is None:
+                s = np.zeros(len(x), dtype=series_dtype(kinds))
+                s['time'] = x['time']
+            s['I_' + kind] = x['I']
+            for f in SCALARS:
+                row[f'{f}_{kind}'] = x[f][0] if f in metrics else np.nan
+        row['T'] = len(s)
+        series[i, j, str(net)] = s
+    return scalars, series
+
+
+class Results:
+    """Indexed access to the results of a sweep, for the plots:
+
+        res = Results.load('Simulations/SIR_simulation_1000_250_10_0.03.results')
+        res.grid('V_tot', 'dynamic')             # (r x pol) heatmap of the means
+        time, I = res.curve(0.3, 0.5, 'static')  # I(t) of one cell
+
+    The scalar rows are indexed once by (r, pol, net_type); the grids are
+    filled with one vectorized assignment and the curves are a dict lookup
+    (the series of a results store are memory-mapped on first use).
+    r and pol are matched after rounding, not with float equality."""
+
+    def __init__(self, scalars, series):
+        self.scalars = scalars
+        self.series = series           # (i, j, net_type) -> array, or store directory
+        self.r_list = np.array(sorted(set(key(r) for r in scalars['r'])))
+        self.pol_list = np.array(sorted(set(key(pol) for pol in scalars['pol'])))
+        self.net_types = list(dict.fromkeys(str(net) for net in scalars['net_type']))
+        self.kinds = [name[len('ar_'):] for name in scalars.dtype.names if name.startswith('ar_')]
+        r_pos = {r: i for i, r in enumerate(self.r_list)}
+        pol_pos = {pol: j for j, pol in enumerate(self.pol_list)}
+        self.rows_i = np.array([r_pos[key(r)] for r in scalars['r']], dtype=int)
+        self.rows_j = np.array([pol_pos[key(pol)] for pol in scalars['pol']], dtype=int)
+        self.index = {(key(row['r']), key(row['pol']), str(row['net_type'])): n for n, row in enumerate(scalars)}
+        self.grids = {}
+        self.curves = {}
+
+    @classmethod
+    def load(cls, path):
+        """Results of a store directory (see write_store) or of a CSV file"""
+        if os.path.isdir(path):
+            return cls(load_store(path), path)
+        return cls(*csv_cells(path))
+
+    def row(self, r, pol, net_type):
+        """Scalar row of a cell"""
+        try:
+            return self.scalars[self.index[key(r), key(pol), net_type]]
+        except KeyError:
+            raise KeyError(f'no cell r={r}, pol={pol}, net_type={net_type}') from None
+
+    def grid(self, metric, net_type, kind='mean'):
+        """(len(r_list), len(pol_list)) array of a scalar metric (ar, cc, V_tot, nsim, T),
+        NaN where a cell is missing"""
+        column = metric if metric in ('nsim', 'T') else f'{metric}_{kind}'
+        if (column, net_type) not in self.grids:
+            grid = np.full((len(self.r_list), len(self.pol_list)), np.nan)
+            rows = self.scalars['net_type'] == net_type
+            grid[self.rows_i[rows], self.rows_j[rows]] = self.scalars[column][rows]
+            self.grids[column, net_type] = grid
+        return self.grids[column, net_type]
+
+    def cell_series(self, r, pol, net_type):
+        """Time series array of a cell (columns time, I_mean, I_std, ...)"""
+        row = self.row(r, pol, net_type)
+        k = (int(row['i']), int(row['j']), net_type)
+        if k not in self.curves:
+            if isinstance(self.series, dict):
+                self.curves[k] = self.series[k]
+            else:
+                self.curves[k] = load_series(self.series, *k)
+        return self.curves[k]
+
+    def curve(self, r, pol, net_type, kind='mean'):
+        """(time, I) of a cell; kind is mean, std or q<q>"""
+        s = self.cell_series(r, pol, net_type)
+        return s['time'], s['I_' + kind]
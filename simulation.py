@@ -1,42 +1,107 @@
 import numpy as np
-import networkx as nx
 import json
 from utils import SIR_net_adaptive, initNET_rnd
+from fast_utils import SIR_net_adaptive_csr, SIR_net_adaptive_batch, SIR_adaptive_arrays
+from fast_utils import csr_to_graph, csr_edges, edges_to_csr, average_clustering
+from gillespie import SIR_net_adaptive_gillespie
 import sys
+import os
+import argparse
 import multiprocessing as mp
 import time
+from checkpoint import Sweep, save_replica, replica_seed, done_cells, cell_name
+from results import scalar_dtype, series_dtype, save_cell, load_cell, write_csv, write_store
+from aggregation import Welford, Reservoir
+from networks import share_csr, attach_csr, release, NetworkCache, barabasi_albert_edges
+from refinement import lattice, QuadTree
+from profiling import PhaseProfile, add_totals, report
+from checkpoint import atomic_write
+from trajectories import TrajectoryWriter, trajectory
+from telemetry import ProgressReporter, StatusBoard
 
 # import parameters of the simulation
 with open('parameters.txt') as f:
     raw_par = f.read()
 par = json.loads(raw_par)
 
-nsim = int(sys.argv[1]) # number of simulations
+# simulation engines (par['engine']): 'networkx' is the reference implementation, 'csr' the
+# array-backed one (same model). 'gillespie' is the event-driven continuous time version: it
+# is NOT interchangeable with the other two, since its events are sequential instead of
+# synchronous and it ends up with far fewer no vax and a lower clustering (see gillespie.py)
+engines = {'networkx': SIR_net_adaptive, 'csr': SIR_net_adaptive_csr, 'gillespie': SIR_net_adaptive_gillespie}
 
+# state of the worker processes, set by init_worker
+worker = {}
 
 
-# output file
-# time pol r attak_rate clustering_mean clustering ave/std stat/dyn
+def init_worker(par, network_spec=None, cache=None, ensemble=None, archive=None, status_queue=None):
+    """Pool initializer: the parameters are sent once per worker and, if given,
+    the physical network in shared memory is attached (zero-copy) or the
+    network cache is set up (replica k uses the cached graph of seed k % ensemble),
+    the trajectories are appended to the archive directory and the progress
+    is sent to the status queue (see telemetry.py)"""
+    worker['par'] = par
+    if status_queue is not None:
+        worker['progress'] = ProgressReporter(status_queue)
+    if archive is not None:
+        worker['archive'] = TrajectoryWriter(archive)
+    if network_spec is not None:
+        worker['csr'] = attach_csr(network_spec)
+        worker['cc'] = average_clustering(*worker['csr'])
+    if cache is not None:
+        worker['cache'] = cache
+        worker['ensemble'] = ensemble
 
-filename = 'Simulations/SIR_simulation_{N}_{n_novax}_{degree}_{beta}.csv'.format(N=par['N'], n_novax=par['n_novax'], degree=par['ave_degree'], beta=par["beta"])
-output = open(filename, 'a')
-columns = ['time,I,pol,r,ar,cc,V_tot,kind,net_type']
-output.writelines(columns)
-output.write('\n')
 
-# random generator
-rng = np.random.default_rng(2022)
+def physical_network(k):
+    """Physical network (CSR adjacency and clustering) of replica k, or
+    (None, None) if every replica has to generate its own"""
+    if 'cache' in worker:
+        par = worker['par']
+        csr = worker['cache'].csr('barabasi_albert_native', par['N'], int(par['ave_degree']/2), k % worker['ensemble'])
+        return csr, average_clustering(*csr)
+    return worker.get('csr'), worker.get('cc')
 
-def simulation_step(par, rng, r, pol):
-    seed = rng.integers(1, 1000)
+
+def kernel_seed(rng):
+    """Seed of the dynamics of a replica: a child of the SeedSequence of its
+    stream rng. The static and the dynamic run start a new Generator from
+    it, so they share their random numbers."""
+    return rng.bit_generator.seed_seq.spawn(1)[0]
+
+
+def simulation_step(par, rng, r, pol, csr=None, cc_phys=None, trajectories=None, progress=None):
+    """One replica on the static and on the dynamic information network.
+    csr: CSR adjacency of a pre-built physical network (e.g. in shared memory)
+    to use instead of a new Barabasi-Albert graph (networks.barabasi_albert_edges),
+    cc_phys its clustering,
+    trajectories: optional list that gets the full trajectories of the static
+    and of the dynamic run (see trajectories.trajectory), as one pair,
+    progress: optional telemetry.ProgressReporter of the worker.
+    Everything random, including the graph, is drawn from rng, the stream of
+    the replica, or from a child of its SeedSequence (the dynamics), so the
+    answer only depends on its seed."""
+    seed = kernel_seed(rng)
     initial_novax = rng.choice(np.arange(par['N']), par['n_novax'])
     initial_infecteds = rng.choice(np.arange(par['N']), par['n_infecteds'])
-    phys_net = nx.barabasi_albert_graph(par['N'], int(par['ave_degree']/2))
+    if csr is None:
+        csr = edges_to_csr(par['N'], *barabasi_albert_edges(par['N'], int(par['ave_degree']/2), rng))
+        cc_phys = average_clustering(*csr)
+    if par.get('engine', 'networkx') == 'csr':
+        return simulation_step_arrays(par, csr, cc_phys, seed, initial_novax, initial_infecteds, r, pol, trajectories, progress)
+    phys_net = csr_to_graph(*csr)
     info_net_stat = phys_net.copy()
     initNET_rnd(info_net_stat, initial_novax=initial_novax)
     info_net_dyn = info_net_stat.copy()
+    SIR_engine = engines[par.get('engine', 'networkx')]
+    # optional per phase profiling (par['profile'], networkx and csr engines only)
+    profiles = [PhaseProfile(), PhaseProfile()] if par.get('profile', False) else [None, None]
+    extra = [{} if p is None else {'profile': p} for p in profiles]
+    if progress is not None:
+        for e, net_type in zip(extra, CellStats.net_types):
+            e['progress'] = progress.run(net_type)
 
-    time_stat, _, I_stat, _, V_stat, I_tot_stat, _, _ = SIR_net_adaptive(
+    outputs_stat = SIR_engine(
         phys_net, info_net_stat,
         beta=par['beta'],
         mu=par['mu'],
@@ -46,9 +111,12 @@ def simulation_step(par, rng, r, pol):
         initial_infecteds=initial_infecteds,
         rewiring=False,
         rng=np.random.default_rng(seed),
-        message=False)
+        message=False,
+        opinions=trajectories is not None,
+        clustering=True,
+        **extra[0])
 
-    time_dyn, _, I_dyn, _, V_dyn, I_tot_dyn, _, _ = SIR_net_adaptive(
+    outputs_dyn = SIR_engine(
         phys_net, info_net_dyn,
         beta=par['beta'],
         mu=par['mu'],
@@ -58,77 +126,471 @@ def simulation_step(par, rng, r, pol):
         initial_infecteds=initial_infecteds,
         rewiring=True,
         rng=np.random.default_rng(seed),
-        message=False)
-    cc_stat = nx.algorithms.cluster.average_clustering(info_net_stat)
-    cc_dyn = nx.algorithms.cluster.average_clustering(info_net_dyn)
+        message=False,
+        opinions=trajectories is not None,
+        clustering=True,
+        **extra[1])
+
+    time_stat, _, I_stat, _, V_stat, I_tot_stat = outputs_stat[:6]
+    time_dyn, _, I_dyn, _, V_dyn, I_tot_dyn = outputs_dyn[:6]
+    cc_stat, cc_dyn = outputs_stat[-1], outputs_dyn[-1]
+    if trajectories is not None:
+        trajectories.append((trajectory(outputs_stat), trajectory(outputs_dyn)))
 
     return(
         [len(time_stat), len(time_dyn)],
         [I_stat, I_dyn],
         [I_tot_stat, I_tot_dyn],
+        [cc_stat[-1], cc_dyn[-1]],
+        [V_stat[-1], V_dyn[-1]]) + profile_totals(profiles)
+
+
+def profile_totals(profiles):
+    """Extra item of the answers of simulation_step when profiling: the phase
+    totals of the static and of the dynamic run"""
+    if profiles[0] is None:
+        return ()
+    return ([p.totals() for p in profiles],)
+
+
+def simulation_step_arrays(par, csr, cc_phys, seed, initial_novax, initial_infecteds, r, pol, trajectories=None, progress=None):
+    """simulation_step on a CSR physical network with the array engine: the
+    network is only read, every replica allocates its state arrays and its own
+    copy of the information network edges."""
+    aware = np.zeros(par['N'], dtype=np.int8)
+    aware[initial_novax] = 1
+    profiles = [PhaseProfile(), PhaseProfile()] if par.get('profile', False) else [None, None]
+    answers = []
+    for rewiring in (False, True):
+        u_info, v_info = csr_edges(*csr)
+        outputs, _, _, _, u_info, v_info = SIR_adaptive_arrays(
+            csr, u_info, v_info, aware,
+            beta=par['beta'],
+            mu=par['mu'],
+            r=r,
+            pro=par['pro'],
+            pol=pol,
+            initial_infecteds=initial_infecteds,
+            rewiring=rewiring,
+            rng=np.random.default_rng(seed),
+            message=False,
+            opinions=trajectories is not None,
+            profile=profiles[rewiring],
+            progress=None if progress is None else progress.run(CellStats.net_types[rewiring]))
+        cc = average_clustering(*edges_to_csr(par['N'], u_info, v_info)) if rewiring else cc_phys
+        answers.append((outputs, cc))
+    (stat, cc_stat), (dyn, cc_dyn) = answers
+    if trajectories is not None:
+        trajectories.append((trajectory(stat), trajectory(dyn)))
+
+    return(
+        [len(stat[0]), len(dyn[0])],
+        [stat[2], dyn[2]],
+        [stat[5], dyn[5]],
         [cc_stat, cc_dyn],
-        [V_stat[-1], V_dyn[-1]])
-    
-
-def simulate_params(r, pol, par, rng, out_file):
-    pool = mp.Pool(mp.cpu_count())
-    results = [pool.apply_async(simulation_step, args=(par, rng, r, pol)) for _ in range(nsim)]
-    answers = [res.get(timeout=600) for res in results]
-    pool.close()
-
-    answers = np.array(answers, dtype=object) # [nsim, 5, 2]
-    static_data = answers[:, :, 0] # [nsim, 5]
-    dynamic_data = answers[:, :, 1]# [nsim, 5]
-    min_time_stat = min(static_data[:, 0])
-    min_time_dyn = min(dynamic_data[:, 0])
-
-    mean_I_stat = np.mean([static_data[i, 1][:min_time_stat] for i in range(nsim)], axis=0)
-    std_I_stat = np.std([static_data[i, 1][:min_time_stat] for i in range(nsim)], axis=0)
-    mean_I_dyn = np.mean([dynamic_data[i, 1][:min_time_dyn] for i in range(nsim)], axis=0)
-    std_I_dyn = np.std([dynamic_data[i, 1][:min_time_dyn] for i in range(nsim)], axis=0)
-
-    mean_I_tot_stat = np.mean(static_data[:, 2])
-    std_I_tot_stat = np.std(static_data[:, 2])
-    mean_I_tot_dyn = np.mean(dynamic_data[:, 2])
-    std_I_tot_dyn = np.std(dynamic_data[:, 2])
-
-    mean_cc_stat = np.mean(static_data[:, 3])
-    std_cc_stat = np.std(static_data[:, 3])
-    mean_cc_dyn = np.mean(dynamic_data[:, 3])
-    std_cc_dyn = np.std(dynamic_data[:, 3])
-
-    mean_V_tot_stat = np.mean(static_data[:, 4])
-    std_V_tot_stat = np.std(static_data[:, 4])
-    mean_V_tot_dyn = np.mean(dynamic_data[:, 4])
-    std_V_tot_dyn = np.std(dynamic_data[:, 4])
-
-    times_stat = np.arange(min_time_stat)
-    times_dyn = np.arange(min_time_dyn)
-
-    for t, i_mean, i_std in zip(times_stat, mean_I_stat, std_I_stat):
-        out_file.write(f'{t},{round(i_mean, 2)},{round(pol, 1)},{round(r, 1)},{int(mean_I_tot_stat)},{round(mean_cc_stat, 3)},{mean_V_tot_stat},mean,static')
-        out_file.write('\n')
-        out_file.write(f'{t},{round(i_std,2)},{round(pol, 1)},{round(r, 1)},{int(std_I_tot_stat)},{round(std_cc_stat, 3)},{std_V_tot_stat},std,static')
-        out_file.write('\n')
-
-    for t, i_mean, i_std in zip(times_dyn, mean_I_dyn, std_I_dyn):
-        out_file.write(f'{t},{round(i_mean, 2)},{round(pol, 1)},{round(r, 1)},{int(mean_I_tot_dyn)},{round(mean_cc_dyn, 3)},{mean_V_tot_dyn},mean,dynamic')
-        out_file.write('\n')
-        out_file.write(f'{t},{round(i_std, 2)},{round(pol, 1)},{round(r, 1)},{int(std_I_tot_dyn)},{round(std_cc_dyn, 3)},{std_V_tot_dyn},std,dynamic')
-        out_file.write('\n')
-    print(f'completed: r={r}, pol={pol}')
-    
-r_list = np.arange(0.1, 1., 0.1)
-pol_list = np.arange(0.1, 1., 0.1)
-start_tot = time.time()
-for r in r_list:
-    for pol in pol_list:
-        start = time.time()
-        simulate_params(r, pol, par, rng, output)
-        stop = time.time()
-        print('simulation took:', round((stop - start)/60, 1), 'min')
-        print('total time:', round((stop - start_tot)/60, 1), 'min', '\n')
-stop_tot = time.time()
-output.close()
-print('\nSimulation completed')
-print('total simulation time:', round((stop_tot - start_tot)/60, 1), 'min')
\ No newline at end of file
+        [stat[4][-1], dyn[4][-1]]) + profile_totals(profiles)
+
+
+def simulation_batch(par, rngs, r, pol, graph_seed, csr=None, cc_phys=None, trajectories=None, progress=None):
+    """Run the replicas with streams rngs (one Generator per replica) together
+    with SIR_net_adaptive_batch on one shared physical network (the
+    Barabasi-Albert graph of graph_seed, or the CSR adjacency csr with
+    clustering cc_phys). Every replica draws its initial conditions and its
+    dynamics from its own stream, as in simulation_step, so its answer does
+    not depend on the other replicas of the batch.
+    trajectories, progress: as in simulation_step (one trajectory pair per replica).
+    Returns one simulation_step-like answer per replica."""
+    n_rep = len(rngs)
+    seeds = [kernel_seed(rng) for rng in rngs]
+    aware = np.zeros((n_rep, par['N']), dtype=np.int8)
+    initial_infecteds = []
+    for m, rng in enumerate(rngs):
+        aware[m, rng.choice(np.arange(par['N']), par['n_novax'])] = 1
+        initial_infecteds.append(rng.choice(np.arange(par['N']), par['n_infecteds']))
+    if csr is None:
+        csr = edges_to_csr(par['N'], *barabasi_albert_edges(par['N'], int(par['ave_degree']/2), np.random.default_rng(graph_seed)))
+        cc_phys = average_clustering(*csr)
+
+    answers = {}
+    for net_type, rewiring in (('stat', False), ('dyn', True)):
+        answers[net_type] = SIR_net_adaptive_batch(
+            csr, aware,
+            beta=par['beta'],
+            mu=par['mu'],
+            r=r,
+            pro=par['pro'],
+            pol=pol,
+            initial_infecteds=initial_infecteds,
+            rewiring=rewiring,
+            rng=[np.random.default_rng(seed) for seed in seeds],
+            message=False,
+            opinions=trajectories is not None,
+            progress=None if progress is None else progress.run(CellStats.net_types[rewiring]))
+
+    (res_stat, edges_stat), (res_dyn, edges_dyn) = answers['stat'], answers['dyn']
+    batch = []
+    for m in range(n_rep):
+        cc_dyn = average_clustering(*edges_to_csr(par['N'], *edges_dyn[m]))
+        batch.append((
+            [len(res_stat[m][0]), len(res_dyn[m][0])],
+            [res_stat[m][2], res_dyn[m][2]],
+            [res_stat[m][5], res_dyn[m][5]],
+            [cc_phys, cc_dyn],  # the static information network keeps the structure of the physical one
+            [res_stat[m][4][-1], res_dyn[m][4][-1]]))
+        if trajectories is not None:
+            trajectories.append((trajectory(res_stat[m]), trajectory(res_dyn[m])))
+    return batch
+
+
+def run_task(task):
+    """Worker entry point: run the given replicas of the cell (i, j), save them
+    in the sweep directory (and their trajectories in the archive, if any) and
+    return them with the cell key and their indices"""
+    cell, r, pol, replicas, directory = task
+    par = worker['par']
+    rngs = [np.random.default_rng(replica_seed(cell, k)) for k in replicas]
+    trajectories = [] if 'archive' in worker else None
+    progress = worker.get('progress')
+    if par.get('batch', False):
+        # the batch shares the network of the first replica of its block (see make_tasks),
+        # so the physical network of a replica depends on the batch size unless it is shared
+        first = replicas[0] - replicas[0] % batch_size(par)
+        if progress is not None:
+            progress.replica(cell, replicas[0])
+        answers = simulation_batch(par, rngs, r, pol, replica_seed(cell, first, entropy=2023), *physical_network(first),
+                                   trajectories=trajectories, progress=progress)
+    else:
+        answers = []
+        for rng, k in zip(rngs, replicas):
+            if progress is not None:
+                progress.replica(cell, k)
+            answers.append(simulation_step(par, rng, r, pol, *physical_network(k), trajectories=trajectories, progress=progress))
+    for n, (k, answer) in enumerate(zip(replicas, answers)):
+        if trajectories is not None:
+            for net_type, fields in zip(CellStats.net_types, trajectories[n]):
+                worker['archive'].append(cell, k, net_type, fields)
+        save_replica(directory, cell, k, answer)
+        if progress is not None:
+            progress.done(cell, k, len(replicas))
+    return cell, replicas, answers
+
+
+def batch_size(par):
+    return par.get('batch_size', 16)
+
+
+def make_tasks(sweep, par, targets):
+    """Flatten the cells into tasks: replicas 0..targets[cell]-1 of every cell,
+    skipping the ones saved by a previous run. Every replica has its own
+    random stream (seeded by replica_seed), so the results do not depend on
+    the number of workers nor on the order of the tasks. Without batching
+    every replica is a task; with batching the replicas k with the same
+    k // batch_size form a task (fixed blocks, so a resumed or a wider sweep
+    groups them in the same way). The replicas of a batch share one physical
+    network, so the results of a batched sweep do not depend on the batch
+    size only with --shared-network (then they are also the same as without
+    batching)."""
+    tasks = []
+    for cell, nsim in targets.items():
+        done = set(sweep.done_replicas(cell))
+        missing = [k for k in range(nsim) if k not in done]
+        if par.get('batch', False):
+            blocks = {}
+            for k in missing:
+                blocks.setdefault(k // batch_size(par), []).append(k)
+            groups = list(blocks.values())
+        else:
+            groups = [[k] for k in missing]
+        r, pol = sweep.r_list[cell[0]], sweep.pol_list[cell[1]]
+        for replicas in groups:
+            tasks.append((cell, r, pol, replicas, sweep.directory))
+    return tasks
+
+
+class CellStats:
+    """Streaming statistics of the replicas of one (r, pol) cell: mean and std
+    of I(t) (the replicas that are over count as zeros) and of the attack rate,
+    clustering and total vaccinations, plus optional quantiles from a bounded
+    random sample of the replicas, and the phase profile totals of the
+    replicas run with par['profile']. The replicas are added in the order of
+    their index, whatever the order in which they arrive, so the statistics
+    of a cell are the same with any number of workers."""
+
+    net_types = ('static', 'dynamic')
+    fields = {'I': 1, 'ar': 2, 'cc': 3, 'V_tot': 4}   # position in the answers of simulation_step
+
+    def __init__(self, quantiles=(), reservoir_size=64, seed=0):
+        self.quantiles = quantiles
+        self.moments = {net: {f: Welford() for f in self.fields} for net in self.net_types}
+        self.samples = {net: Reservoir(reservoir_size, np.random.default_rng(seed)) for net in self.net_types}
+        self.profile = {net: {} for net in self.net_types}
+        self.next = 0          # index of the next replica to add
+        self.pending = {}      # replicas arrived before it
+
+    def add(self, answer, k):
+        """Add replica k (once all the replicas before k are in)"""
+        self.pending[k] = answer
+        while self.next in self.pending:
+            self._add(self.pending.pop(self.next))
+            self.next += 1
+
+    def _add(self, answer):
+        for n, net in enumerate(self.net_types):
+            values = {f: answer[k][n] for f, k in self.fields.items()}
+            for f, x in values.items():
+                self.moments[net][f].add(x)
+            if self.quantiles:
+                self.samples[net].add(values)
+            if len(answer) > 5:
+                add_totals(self.profile[net], answer[5][n])
+
+    def converged(self, width, z=1.96):
+        """Whether the confidence intervals of the mean attack rate, clustering
+        and total vaccinations are all narrower than width (relative to the mean)"""
+        for net in self.net_types:
+            for f in ('ar', 'cc', 'V_tot'):
+                m = self.moments[net][f]
+                if m.halfwidth(z)[0] > width * abs(m.mean[0]):
+                    return False
+        return True
+
+
+def simulate_params(cell, r, pol, stats):
+    """Summary statistics of the replicas of one (r, pol) cell as columnar
+    arrays (see results.py): the scalar rows and the time series of every net_type"""
+    kinds = ['mean', 'std'] + [f'q{q:g}' for q in stats.quantiles]
+    scalars = np.zeros(len(stats.net_types), dtype=scalar_dtype(kinds))
+    series = {}
+    for n, net in enumerate(stats.net_types):
+        m = stats.moments[net]
+        sample = stats.samples[net]
+        T = len(m['I'].mean)
+        s = np.zeros(T, dtype=series_dtype(kinds))
+        s['time'] = np.arange(T)
+        s['I_mean'], s['I_std'] = m['I'].mean, m['I'].std
+        row = scalars[n:n + 1]
+        row['i'], row['j'], row['r'], row['pol'] = cell[0], cell[1], r, pol
+        row['net_type'], row['nsim'], row['T'] = net, m['I'].n, T
+        for f in ('ar', 'cc', 'V_tot'):
+            row[f + '_mean'], row[f + '_std'] = m[f].mean[0], m[f].std[0]
+        for q in stats.quantiles:
+            s[f'I_q{q:g}'] = sample.quantile(q, key=lambda x: x['I'], length=T)
+            for f in ('ar', 'cc', 'V_tot'):
+                row[f'{f}_q{q:g}'] = sample.quantile(q, key=lambda x: x[f])[0]
+        series[net] = s
+    print(f'completed: r={r}, pol={pol}, nsim={stats.moments["static"]["I"].n}')
+    return scalars, series
+
+
+def complete_cell(sweep, cell, stats):
+    scalars, series = simulate_params(cell, sweep.r_list[cell[0]], sweep.pol_list[cell[1]], stats)
+    save_cell(sweep.cells_dir, cell_name(cell), scalars, series)
+    if stats.profile['static']:
+        atomic_write(os.path.join(sweep.cells_dir, cell_name(cell) + '.profile.json'), json.dumps(stats.profile, indent=1))
+        for net in stats.net_types:
+            print(f'profile {net}: {report(stats.profile[net])}')
+    sweep.complete(cell)
+
+
+def run_wave(sweep, par, targets, stats, pool, n_workers, done, status=None):
+    """Run the replicas 0..targets[cell]-1 of the given cells on the pool: the
+    tasks of all the cells are queued at once (in chunks of a few tasks, so
+    all the workers stay busy until the end of the wave) and every replica is
+    added to the statistics of its cell as it arrives. done(cell) is called as
+    soon as the last replica of a cell is in. status: optional
+    telemetry.StatusBoard that gets the queued replicas."""
+    tasks = make_tasks(sweep, par, targets)
+    missing = {}
+    for task in tasks:
+        missing[task[0]] = missing.get(task[0], 0) + len(task[3])
+    if status is not None:
+        for cell in missing:
+            status.plan(cell, targets[cell] - missing[cell], targets[cell])
+    for cell in targets:
+        if cell not in missing:
+            done(cell)
+
+    # no timeout: a replica may take long on large networks (stalls show up with --status)
+    chunksize = max(1, min(4, len(tasks) // (32 * n_workers)))
+    for cell, replicas, answers in pool.imap_unordered(run_task, tasks, chunksize=chunksize):
+        for k, answer in zip(replicas, answers):
+            stats[cell].add(answer, k)
+        missing[cell] -= len(answers)
+        if missing[cell] == 0:
+            done(cell)
+
+
+def simulate_grid(sweep, par, nsim, pool, n_workers, ci_width=None, max_nsim=None, wave=None, cells=None, status=None):
+    """Run the whole grid (or only the given cells) on one pool, nsim replicas per cell.
+    With ci_width the replicas are run in waves: after nsim replicas a cell is
+    completed only if its statistics have converged (see CellStats.converged),
+    otherwise it gets `wave` more replicas in the next round, up to max_nsim.
+    The converged cells drop out, so the later waves only run the noisy ones.
+    status: optional telemetry.StatusBoard of the sweep."""
+    stats = {}
+    targets = {}
+    for cell in sweep.cells():
+        if cells is not None and cell not in cells:
+            continue
+        stats[cell] = CellStats(par.get('quantiles', ()), seed=replica_seed(cell, max_nsim or nsim))
+        for k, answer in zip(sweep.done_replicas(cell), sweep.iter_replicas(cell)):   # saved by a previous run
+            stats[cell].add(answer, k)
+        targets[cell] = max([nsim] + [k + 1 for k in sweep.done_replicas(cell)])
+
+    start_tot = time.time()
+    while targets:
+        next_targets = {}
+
+        def done(cell):
+            n = targets[cell]
+            if ci_width is None or n >= max_nsim or stats[cell].converged(ci_width):
+                complete_cell(sweep, cell, stats.pop(cell))
+                if status is not None:
+                    status.complete(cell)
+                print('total time:', round((time.time() - start_tot)/60, 1), 'min', '\n')
+            else:
+                next_targets[cell] = min(n + wave, max_nsim)
+
+        run_wave(sweep, par, targets, stats, pool, n_workers, done, status)
+        if next_targets:
+            print(f'{len(next_targets)} cells not converged, next wave of {wave} replicas')
+        targets = next_targets
+
+
+def cell_metrics(sweep, cell):
+    """Mean attack rate and clustering (static and dynamic) of a completed cell"""
+    scalars, _ = load_cell(sweep.cells_dir, cell_name(cell), mmap=False)
+    return np.array([row[f + '_mean'] for row in scalars for f in ('ar', 'cc')])
+
+
+def refine_grid(sweep, tree, threshold, budget, *args, **kwargs):
+    """Quadtree sweep (see refinement.py): simulate the corners of the leaves
+    of tree, split the leaves where the attack rate or the clustering change
+    the most and simulate the new corners, until nothing changes by more than
+    threshold (fraction of the range) or the grid has budget cells.
+    args and kwargs are passed to simulate_grid. A resumed sweep replays the same
+    refinement from the completed cells."""
+    cells = tree.cells()
+    while cells:
+        print(f'refinement: {len(cells)} new cells, {len(tree.leaves)} squares')
+        simulate_grid(sweep, *args, cells=set(cells), **kwargs)
+        cells = tree.refine({cell: cell_metrics(sweep, cell) for cell in tree.cells()}, threshold, budget)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulations over the (r, pol) grid with the parameters of parameters.txt')
+    parser.add_argument('nsim', type=int, nargs='?', help='number of simulations per cell')
+    parser.add_argument('--sweep-dir', help='checkpoint directory of the sweep (default: next to the output file)')
+    parser.add_argument('--shard', type=int, default=0, help='index of the shard of the grid to run')
+    parser.add_argument('--nshards', type=int, default=1, help='number of shards the grid is split into')
+    parser.add_argument('--shared-network', action='store_true', help='build one physical network and share it with all the workers (shared memory)')
+    parser.add_argument('--network-cache', metavar='DIR', help='take the physical networks from an on-disk cache of generated graphs')
+    parser.add_argument('--ensemble', type=int, help='number of cached graphs used by the sweep (default: nsim)')
+    parser.add_argument('--cache-max-mb', type=float, default=1024, help='size limit of the network cache')
+    parser.add_argument('--format', choices=['binary', 'csv', 'both'], default='both', help='binary results store (see results.py) and/or CSV file for the notebooks (default: both, --format binary to skip the CSV)')
+    parser.add_argument('--merge', nargs='+', metavar='DIR', help='only merge the completed cells of these sweep directories into the output')
+    parser.add_argument('--ci-width', type=float, help='adaptive replication: run replicas in waves until the 95%% confidence intervals of ar, cc and V_tot are narrower than this fraction of their mean (nsim is then the first wave)')
+    parser.add_argument('--max-nsim', type=int, help='adaptive replication: maximum number of replicas per cell (default: 10 nsim)')
+    parser.add_argument('--wave', type=int, help='adaptive replication: replicas added to a cell per wave (default: nsim)')
+    parser.add_argument('--refine', type=int, metavar='DEPTH', help='adaptive grid: start from a 5 x 5 grid and split the squares where ar or cc change sharply, at most DEPTH times')
+    parser.add_argument('--refine-threshold', type=float, default=0.1, help='adaptive grid: split a square if ar or cc change across it by more than this fraction of their range')
+    parser.add_argument('--budget', type=int, default=81, help='adaptive grid: maximum number of cells')
+    parser.add_argument('--profile', action='store_true', help='record the time and the operations of every phase of the simulations, aggregated per cell in <cell>.profile.json')
+    parser.add_argument('--status', action='store_true', help='publish the live progress of the sweep (throughput, ETA of the cells, state of the workers) in <sweep_dir>/status.json, see telemetry.py')
+    parser.add_argument('--status-port', type=int, help='also serve the live progress as JSON on http://127.0.0.1:PORT/')
+    parser.add_argument('--trajectories', action='store_true', help='archive the full trajectories of every replica (S, I, R, V, NV, PV, changers, bichangers) in <sweep_dir>/trajectories, see trajectories.py')
+    args = parser.parse_args()
+
+    # output file
+    # time pol r attak_rate clustering_mean clustering ave/std stat/dyn
+
+    filename = 'Simulations/SIR_simulation_{N}_{n_novax}_{degree}_{beta}.csv'.format(N=par['N'], n_novax=par['n_novax'], degree=par['ave_degree'], beta=par["beta"])
+    columns = 'time,I,pol,r,ar,cc,V_tot,kind,net_type'
+    sweep_dir = args.sweep_dir or filename[:-len('.csv')] + '.sweep'
+    store = filename[:-len('.csv')] + '.results'
+
+    def write_output(directories):
+        # the outputs are rewritten from the checkpoints; the first CSV file found is kept as
+        # .bak (the later ones were written from the checkpoints, so they can be written again)
+        cells = done_cells(directories)
+        if args.format in ('binary', 'both'):
+            write_store(cells, store)
+            print(f'{len(cells)} cells written to {store}')
+        if args.format in ('csv', 'both'):
+            if os.path.exists(filename) and not os.path.exists(filename + '.bak'):
+                os.replace(filename, filename + '.bak')
+            write_csv(cells, filename, columns)
+            print(f'{len(cells)} cells written to {filename}')
+
+    if args.merge:
+        write_output(args.merge)
+        sys.exit()
+    if args.nsim is None:
+        parser.error('nsim is required')
+    if args.shared_network and args.network_cache:
+        parser.error('--shared-network and --network-cache are alternative')
+    if args.profile and (par.get('engine', 'networkx') == 'gillespie' or par.get('batch', False)):
+        parser.error('--profile needs the networkx or csr engine without batching')
+    if par.get('batch', False) and not args.shared_network:
+        print('warning: batching without --shared-network, every batch draws its own physical network, '
+              'so the results depend on batch_size', file=sys.stderr)
+
+    r_list = np.arange(0.1, 1., 0.1)
+    pol_list = np.arange(0.1, 1., 0.1)
+    if args.refine is not None:
+        if args.nshards > 1:
+            parser.error('--refine cannot be sharded')
+        r_list = pol_list = lattice(0.1, 0.9, 5, args.refine)
+    if args.nshards > 1:
+        sweep_dir = os.path.join(sweep_dir, f'shard_{args.shard}_of_{args.nshards}')
+    sweep_par = dict(par, shared_network=True) if args.shared_network else par
+    cache, ensemble = None, None
+    if args.network_cache:
+        cache = NetworkCache(args.network_cache, int(args.cache_max_mb * 2**20))
+        ensemble = args.ensemble or args.nsim
+        sweep_par = dict(par, network_ensemble=ensemble)
+    max_nsim, wave = None, None
+    if args.ci_width is not None:
+        max_nsim = args.max_nsim or 10 * args.nsim
+        wave = args.wave or args.nsim
+        sweep_par = dict(sweep_par, adaptive={'ci_width': args.ci_width, 'max_nsim': max_nsim, 'wave': wave})
+    if args.refine is not None:
+        sweep_par = dict(sweep_par, refine={'depth': args.refine, 'threshold': args.refine_threshold, 'budget': args.budget})
+    sweep = Sweep(sweep_dir, sweep_par, args.nsim, r_list, pol_list, args.shard, args.nshards)
+    if args.refine is None:
+        print(f'{len(sweep.cells())} cells to simulate, checkpoints in {sweep_dir}')
+    else:
+        print(f'adaptive grid of at most {args.budget} cells, checkpoints in {sweep_dir}')
+
+    start_tot = time.time()
+    blocks, network_spec = [], None
+    if args.shared_network:
+        # one network for the whole sweep, placed once in shared memory
+        phys_net = barabasi_albert_edges(par['N'], int(par['ave_degree']/2), np.random.default_rng(2022))
+        blocks, network_spec = share_csr(*edges_to_csr(par['N'], *phys_net))
+        del phys_net
+    n_workers = mp.cpu_count()
+    run_par = dict(par, profile=True) if args.profile else par     # profiling does not change the results
+    status_queue, status = None, None
+    if args.status or args.status_port is not None:
+        status_queue = mp.Queue()
+        status = StatusBoard(status_queue, n_workers, os.path.join(sweep_dir, 'status.json') if args.status else None, args.status_port)
+    try:
+        archive = os.path.join(sweep_dir, 'trajectories') if args.trajectories else None
+        with mp.Pool(n_workers, initializer=init_worker, initargs=(run_par, network_spec, cache, ensemble, archive, status_queue)) as pool:
+            if args.refine is None:
+                simulate_grid(sweep, run_par, args.nsim, pool, n_workers, args.ci_width, max_nsim, wave, status=status)
+            else:
+                refine_grid(sweep, QuadTree(5, args.refine), args.refine_threshold, args.budget,
+                            run_par, args.nsim, pool, n_workers, args.ci_width, max_nsim, wave, status=status)
+    finally:
+        release(blocks)
+        if status is not None:
+            status.close()
+    stop_tot = time.time()
+    if args.nshards == 1:
+        write_output([sweep_dir])
+    else:
+        print(f'shard completed, merge the shards with: python simulation.py --merge {os.path.dirname(sweep_dir)}')
+    print('\nSimulation completed')
+    print('total simulation time:', round((stop_tot - start_tot)/60, 1), 'min')
@@ -0,0 +1,173 @@
+import numpy as np
+import argparse
+import json
+from results import scalar_dtype, series_dtype, Results
+
+# Deterministic surrogate of simulation.py: a degree-based mean-field map of
+# the SIRV epidemic on the physical network coupled to a pair approximation
+# of the voter model with rewiring on the information network.
+# The stochastic model updates all the nodes synchronously once per time
+# step, so the surrogate is a map with the same time step (the per step
+# probabilities of the model cannot be read as ODE rates without changing
+# the dynamics). Per step, in the order of SIR_net_adaptive:
+#   rewiring   a fraction pol of the discordant edges is cut and replaced by
+#              two concordant ones (the number of edges grows)
+#   epidemic   a susceptible of degree k is infected with probability
+#              1 - (1 - beta * theta)^k, theta being the probability that an
+#              edge points to an infectious node; otherwise a susceptible pro
+#              vax is vaccinated with probability r; infectious recover with mu
+#   opinions   media turn no vax into pro vax with probability pro, the other
+#              non vaccinated nodes copy a random neighbour: a node flips if
+#              the neighbour disagrees, which happens with the fraction of
+#              discordant edge ends of its opinion (pair approximation); a
+#              flip turns its concordant edges into discordant ones and back
+# The information network starts as a copy of the physical one with random
+# opinions, as in simulation_step. All the cells of a grid are integrated
+# together, as arrays of shape (cells, degree classes). The surrogate has no
+# clustering: the cc columns are NaN.
+
+
+def degree_distribution(N, m):
+    """Degrees and probabilities of a Barabasi-Albert network with N nodes and
+    m edges per new node: P(k) ~ 1 / (k (k + 1) (k + 2)) for k >= m, up to the
+    natural cutoff m sqrt(N)"""
+    k = np.arange(m, max(int(m * np.sqrt(N)), m) + 1, dtype=float)
+    pk = 1. / (k * (k + 1) * (k + 2))
+    return k, pk / pk.sum()
+
+
+def mean_field(par, r, pol, rewiring, t_max=2000):
+    """Integrate the surrogate for the cells with parameters r, pol, rewiring
+    (1d arrays of the same length). Returns, for every cell, the time series of
+    the infectious, the number of ever infected (ar) and of vaccinated (V_tot),
+    all in numbers of nodes as in the simulations."""
+    N = par['N']
+    k, pk = degree_distribution(N, int(par['ave_degree'] / 2))
+    k_mean = (k * pk).sum()
+    beta, mu, pro = par['beta'], par['mu'], par['pro']
+    r = np.asarray(r, dtype=float)[:, None]
+    pol = np.asarray(pol, dtype=float) * np.asarray(rewiring, dtype=bool)
+    C = len(pol)
+
+    # fractions of the nodes of every degree class (cells x classes)
+    i0 = par['n_infecteds'] / N
+    x = np.full(C, par['n_novax'] / N)                  # no vax, over all nodes
+    sP = np.full((C, len(k)), (1 - i0) * (1 - x[0]))    # susceptible pro vax
+    sN = np.full((C, len(k)), (1 - i0) * x[0])          # susceptible no vax
+    inf = np.full((C, len(k)), i0)
+    vac = np.zeros((C, len(k)))
+    ever = np.full((C, len(k)), i0)
+    # information network: edges and discordant edges per node
+    e = np.full(C, k_mean / 2)
+    d = 2 * e * x * (1 - x)
+
+    I = [N * inf @ pk]
+    T = np.zeros(C, dtype=int)
+    for t in range(1, t_max + 1):
+        # REWIRING
+        cut = pol * d
+        d = d - cut
+        e = e + cut
+
+        # EPIDEMICS IN THE PHYSICAL NETWORK
+        theta = (inf @ (k * pk)) / k_mean
+        p_inf = 1. - (1. - beta * theta[:, None]) ** k
+        new_inf = (sP + sN) * p_inf
+        new_vac = sP * (1 - p_inf) * r
+        recovered = inf * mu
+
+        # EPIDEMICS IN THE INFORMATION NETWORK
+        qN = np.clip(d / np.maximum(2 * e * x, 1e-12), 0, 1)         # discordant share of the no vax edge ends
+        qP = np.clip(d / np.maximum(2 * e * (1 - x), 1e-12), 0, 1)   # and of the pro vax ones
+        fNP = pro + (1 - pro) * qN
+        fPN = (1 - pro) * qP
+        free_pv = np.maximum(1 - x - vac @ pk, 0)                     # pro vax that are not vaccinated
+        k_info = 2 * e
+        # change of the discordant edges of a flipping node: a voter copied a
+        # discordant neighbour, the other edges are discordant with probability q
+        d = d + (x * pro * k_info * (1 - 2 * qN)
+                 + x * (1 - pro) * qN * ((k_info - 1) * (1 - 2 * qN) - 1)
+                 + free_pv * fPN * ((k_info - 1) * (1 - 2 * qP) - 1))
+        d = np.clip(d, 0, e)
+
+        # UPDATE
+        sP, sN = (sP * (1 - p_inf) * (1 - r) * (1 - fPN[:, None]) + sN * (1 - p_inf) * fNP[:, None],
+                  sN * (1 - p_inf) * (1 - fNP[:, None]) + sP * (1 - p_inf) * (1 - r) * fPN[:, None])
+        inf = inf + new_inf - recovered
+        vac = vac + new_vac
+        ever = ever + new_inf
+        x = x - x * fNP + free_pv * fPN
+
+        I.append(N * inf @ pk)
+        over = (T == 0) & (I[-1] < 0.5)       # less than half an infectious node: the epidemic is over
+        T[over] = t
+        if (T > 0).all():
+            break
+    T[T == 0] = t_max
+    I = np.array(I)
+    return [I[:T[c] + 1, c] for c in range(C)], N * ever @ pk, N * vac @ pk
+
+
+def surrogate_results(par, r_list, pol_list):
+    """Surrogate of a whole (r, pol) grid as results.Results (the same queries
+    as the simulations: grid('ar', 'dynamic'), curve(r, pol, 'static'), ...)"""
+    cells = [(i, j, net) for i in range(len(r_list)) for j in range(len(pol_list)) for net in ('static', 'dynamic')]
+    series_I, ar, V_tot = mean_field(par,
+                                     [r_list[i] for i, _, _ in cells],
+                                     [pol_list[j] for _, j, _ in cells],
+                                     [net == 'dynamic' for _, _, net in cells])
+    scalars = np.zeros(len(cells), dtype=scalar_dtype(['mean']))
+    series = {}
+    for n, (i, j, net) in enumerate(cells):
+        row = scalars[n:n + 1]
+        row['i'], row['j'], row['r'], row['pol'], row['net_type'] = i, j, r_list[i], pol_list[j], net
+        row['T'] = len(series_I[n])
+        row['ar_mean'], row['cc_mean'], row['V_tot_mean'] = ar[n], np.nan, V_tot[n]
+        s = np.zeros(len(series_I[n]), dtype=series_dtype(['mean']))
+        s['time'] = np.arange(len(series_I[n]))
+        s['I_mean'] = series_I[n]
+        series[i, j, net] = s
+    return Results(scalars, series)
+
+
+def disagreement(surrogate, simulated, metric, net_type):
+    """(r x pol) grid of the relative difference between the simulated and the
+    surrogate metric, on the cells of the simulations (NaN elsewhere)"""
+    grid = np.full((len(simulated.r_list), len(simulated.pol_list)), np.nan)
+    for i, r in enumerate(simulated.r_list):
+        for j, pol in enumerate(simulated.pol_list):
+            try:
+                sim = simulated.row(r, pol, net_type)[metric + '_mean']
+                mf = surrogate.row(r, pol, net_type)[metric + '_mean']
+            except KeyError:
+                continue
+            grid[i, j] = abs(sim - mf) / max(abs(sim), 1.)
+    return grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mean-field surrogate of the (r, pol) sweep with the parameters of parameters.txt')
+    parser.add_argument('--compare', metavar='RESULTS', help='results store or CSV of a sweep: list the cells where the surrogate disagrees with it')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative difference above which a cell is listed')
+    args = parser.parse_args()
+
+    with open('parameters.txt') as f:
+        par = json.load(f)
+    r_list = np.round(np.arange(0.1, 1., 0.1), 1)
+    pol_list = np.round(np.arange(0.1, 1., 0.1), 1)
+    surrogate = surrogate_results(par, r_list, pol_list)
+    np.set_printoptions(precision=0, suppress=True, linewidth=150)
+    for metric in ('ar', 'V_tot'):
+        for net_type in ('static', 'dynamic'):
+            print(f'{metric} {net_type} (rows r = {r_list.tolist()}, columns pol)')
+            print(surrogate.grid(metric, net_type))
+
+    if args.compare:
+        simulated = Results.load(args.compare)
+        for metric in ('ar', 'V_tot'):
+            for net_type in ('static', 'dynamic'):
+                diff = disagreement(surrogate, simulated, metric, net_type)
+                for i, j in zip(*np.nonzero(diff > args.tolerance)):
+                    r, pol = simulated.r_list[i], simulated.pol_list[j]
+                    print(f'{metric} {net_type} r={r} pol={pol}: simulated {simulated.row(r, pol, net_type)[metric + "_mean"]:.1f}, '
+                          f'surrogate {surrogate.row(r, pol, net_type)[metric + "_mean"]:.1f}')
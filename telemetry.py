@@ -0,0 +1,190 @@
+import json
+import os
+import queue
+import threading
+import time
+import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from checkpoint import atomic_write, cell_name
+
+# Live progress of a sweep (simulation.py --status / --status-port).
+# The workers send small records to a multiprocessing queue:
+#   ('start', pid, cell, k)                        a replica begins
+#   ('step', pid, net_type, t, infectious, steps_per_s)
+#                                                  at most one per `interval` seconds
+#   ('done', pid, cell, k, seconds)                a replica is saved
+# A thread of the main process collects them and publishes a JSON status
+# with the throughput, the ETA of every cell, the state of every worker and
+# their utilisation, in <sweep_dir>/status.json and optionally on
+# http://127.0.0.1:<port>/. The kernels pay one call per time step
+# (progress=reporter.run(net_type)), the queue one record per interval.
+
+
+class ProgressReporter:
+    """Worker side of the telemetry"""
+
+    def __init__(self, queue, interval=1.):
+        self.queue = queue
+        self.interval = interval
+
+    def replica(self, cell, k):
+        self.queue.put(('start', os.getpid(), cell, k))
+        self.start = time.perf_counter()
+
+    def done(self, cell, k, n=1):
+        """Replica k is saved; it ran with n - 1 others (a batch) since replica()"""
+        self.queue.put(('done', os.getpid(), cell, k, (time.perf_counter() - self.start) / n))
+
+    def run(self, net_type):
+        """progress callback of one run of a kernel (see utils.SIR_net_adaptive)"""
+        last = [time.perf_counter(), 0]         # time and step of the last record
+
+        def progress(t, infectious):
+            now = time.perf_counter()
+            if now - last[0] >= self.interval:
+                self.queue.put(('step', os.getpid(), net_type, int(t), int(infectious), (t - last[1]) / (now - last[0])))
+                last[0], last[1] = now, t
+        return progress
+
+
+class StatusBoard:
+    """Main process side: collects the records of the workers and publishes
+    the status every `interval` seconds. plan(cell, done, target) is called
+    when the replicas of a cell are queued (in the order of the queue),
+    complete(cell) when its summary is written."""
+
+    def __init__(self, queue, n_workers, path=None, port=None, interval=1., stall_after=60.):
+        self.queue = queue
+        self.n_workers = n_workers
+        self.path = path
+        self.interval = interval
+        self.stall_after = stall_after
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.cells = {}          # cell -> {'done', 'target', 'seconds'}
+        self.workers = {}        # pid -> state
+        self.replicas = 0        # replicas done in this run
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.collect, daemon=True)
+        self.thread.start()
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def plan(self, cell, done, target):
+        with self.lock:
+            cell_state = self.cells.pop(cell, {'seconds': 0.})
+            cell_state.update(done=done, target=target)
+            self.cells[cell] = cell_state      # at the end of the queue
+
+    def complete(self, cell):
+        with self.lock:
+            self.cells.pop(cell, None)
+
+    def collect(self):
+        next_write = time.time()
+        while not self.stop.is_set():
+            try:
+                self.receive(self.queue.get(timeout=self.interval))
+            except queue.Empty:
+                pass
+            if self.path is not None and time.time() >= next_write:
+                self.write()
+                next_write = time.time() + self.interval
+
+    def receive(self, record):
+        now = time.time()
+        kind, pid = record[:2]
+        with self.lock:
+            w = self.workers.setdefault(pid, {'busy_s': 0., 'busy_since': None, 'replicas': 0})
+            w['last_seen'] = now
+            if kind == 'start':
+                w.update(cell=record[2], replica=record[3], net_type=None, t=0, infectious=None, steps_per_s=None, busy_since=now)
+            elif kind == 'step':
+                w.update(net_type=record[2], t=record[3], infectious=record[4], steps_per_s=record[5])
+            elif kind == 'done':
+                cell, seconds = record[2], record[4]
+                if w['busy_since'] is not None:
+                    w['busy_s'] += now - w['busy_since']
+                w['busy_since'] = None
+                w['replicas'] += 1
+                self.replicas += 1
+                if cell in self.cells:
+                    self.cells[cell]['done'] += 1
+                    self.cells[cell]['seconds'] += seconds
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            elapsed = max(now - self.start, 1e-9)
+            rate = self.replicas / elapsed
+            busy = sum(w['busy_s'] + (now - w['busy_since'] if w['busy_since'] is not None else 0.) for w in self.workers.values())
+            workers = {}
+            for pid, w in self.workers.items():
+                running = w['busy_since'] is not None
+                workers[str(pid)] = {
+                    'cell': list(w['cell']) if running else None,
+                    'replica': w['replica'] if running else None,
+                    'net_type': w['net_type'] if running else None,
+                    't': w['t'] if running else None,
+                    'infectious': w['infectious'] if running else None,
+                    'steps_per_s': w['steps_per_s'] if running else None,
+                    'replicas': w['replicas'],
+                    'last_seen_s': round(now - w['last_seen'], 1),
+                    'stalled': running and now - w['last_seen'] > self.stall_after}
+            cells = {}
+            queued = 0
+            for cell, c in self.cells.items():
+                remaining = max(c['target'] - c['done'], 0)
+                queued += remaining
+                cells[cell_name(cell)] = {
+                    'done': c['done'], 'target': c['target'],
+                    'seconds_per_replica': c['seconds'] / c['done'] if c['done'] else None,
+                    # the cells are run in the order of the queue
+                    'eta_s': round(queued / rate, 1) if rate > 0 else None}
+            return {
+                'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                'elapsed_s': round(elapsed, 1),
+                'replicas_done': self.replicas,
+                'replicas_queued': queued,
+                'replicas_per_s': rate,
+                'steps_per_s': sum(w['steps_per_s'] or 0. for w in workers.values()),
+                'eta_s': round(queued / rate, 1) if rate > 0 else None,
+                'utilisation': busy / (elapsed * self.n_workers),
+                'stalled_workers': [pid for pid, w in workers.items() if w['stalled']],
+                'workers': workers,
+                'cells': cells}
+
+    def write(self):
+        atomic_write(self.path, json.dumps(self.status(), indent=1))
+
+    def handler(self):
+        board = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(board.status(), indent=1).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        while True:                  # the records still in the queue
+            try:
+                self.receive(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.path is not None:
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,128 @@
+import numpy as np
+import glob
+import os
+
+# Append-only archive of the full trajectories of the replicas of a sweep
+# (simulation.py --trajectories), next to the checkpoints in
+# <sweep_dir>/trajectories. Every worker process appends to its own pair of
+# files, so the writers never need a lock:
+#   data_<pid>.bin    int32 blocks, one per trajectory: the FIELDS one after
+#                     the other, T values each
+#   index_<pid>.bin   one INDEX record per trajectory: cell (i, j), replica,
+#                     net_type, length T and offset of its block (in values)
+# The index record is written after its data block, so an interrupted write
+# leaves at most a block that no record points to. A replica run again after
+# a crash is appended again: the last record of a key wins.
+# TrajectoryArchive memory-maps the data files, so reading a subset of the
+# trajectories only touches their blocks.
+
+FIELDS = ('S', 'I', 'R', 'V', 'NV', 'PV', 'changers', 'bichangers')
+NET_TYPES = ('static', 'dynamic')
+INDEX = np.dtype([('i', 'i4'), ('j', 'i4'), ('replica', 'i4'), ('net_type', 'i4'), ('T', 'i8'), ('offset', 'i8')])
+
+
+def trajectory(outputs):
+    """The FIELDS of the outputs of a simulation engine run with opinions=True"""
+    _, S, I, R, V, _, changers, bichangers, NV, PV = outputs[:10]
+    return {'S': S, 'I': I, 'R': R, 'V': V, 'NV': NV, 'PV': PV, 'changers': changers, 'bichangers': bichangers}
+
+
+class TrajectoryWriter:
+    """Appends trajectories to the files of the current process (opened at
+    the first append, so the writer can be created before the workers fork)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.data = open(os.path.join(self.directory, f'data_{self.pid}.bin'), 'ab')
+        self.index = open(os.path.join(self.directory, f'index_{self.pid}.bin'), 'ab')
+        self.offset = self.data.tell() // 4
+
+    def append(self, cell, k, net_type, fields):
+        """Store the trajectory of replica k of cell (fields: name -> series, see FIELDS)"""
+        if self.pid != os.getpid():
+            self._open()
+        block = np.array([fields[f] for f in FIELDS], dtype=np.int32)
+        record = np.array([(cell[0], cell[1], k, NET_TYPES.index(net_type), block.shape[1], self.offset)], dtype=INDEX)
+        self.data.write(block.tobytes())
+        self.data.flush()
+        self.index.write(record.tobytes())
+        self.index.flush()
+        self.offset += block.size
+
+
+class TrajectoryArchive:
+    """Read access to an archive: archive.get((i, j), k, 'dynamic')['I'],
+    archive.select(cell=(i, j), net_type='static'), ..."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        indexes, self.paths = [], []
+        for path in sorted(glob.glob(os.path.join(directory, 'index_*.bin'))):
+            data = path.replace('index_', 'data_')
+            records = np.fromfile(path, dtype=np.uint8)
+            records = records[:len(records) // INDEX.itemsize * INDEX.itemsize].view(INDEX)   # a record being written
+            records = records[records['offset'] + len(FIELDS) * records['T'] <= os.path.getsize(data) // 4]
+            indexes.append((records, len(self.paths)))
+            self.paths.append(data)
+        self.index = np.zeros(sum(len(records) for records, _ in indexes), dtype=INDEX.descr + [('file', 'i4')])
+        n = 0
+        for records, f in indexes:
+            for name in INDEX.names:
+                self.index[name][n:n + len(records)] = records[name]
+            self.index['file'][n:n + len(records)] = f
+            n += len(records)
+        # the last record of every key
+        keys = self.index[['i', 'j', 'replica', 'net_type']]
+        _, last = np.unique(keys[::-1], return_index=True)
+        self.index = self.index[np.sort(len(keys) - 1 - last)]
+        self.position = {(int(x['i']), int(x['j']), int(x['replica']), NET_TYPES[x['net_type']]): n for n, x in enumerate(self.index)}
+        self.maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        """(i, j, replica, net_type) of the stored trajectories"""
+        return list(self.position)
+
+    def _data(self, f):
+        if f not in self.maps:
+            self.maps[f] = np.memmap(self.paths[f], dtype=np.int32, mode='r')
+        return self.maps[f]
+
+    def _read(self, record):
+        T, offset = int(record['T']), int(record['offset'])
+        block = self._data(int(record['file']))[offset:offset + len(FIELDS) * T].reshape(len(FIELDS), T)
+        return dict(zip(FIELDS, block))
+
+    def get(self, cell, k, net_type):
+        """Trajectory of replica k of cell: field -> read-only series (views of the archive)"""
+        return self._read(self.index[self.position[cell[0], cell[1], k, net_type]])
+
+    def select(self, cell=None, replicas=None, net_type=None):
+        """Index records of the matching trajectories"""
+        keep = np.ones(len(self.index), dtype=bool)
+        if cell is not None:
+            keep &= (self.index['i'] == cell[0]) & (self.index['j'] == cell[1])
+        if replicas is not None:
+            keep &= np.isin(self.index['replica'], replicas)
+        if net_type is not None:
+            keep &= self.index['net_type'] == NET_TYPES.index(net_type)
+        return self.index[keep]
+
+    def iter(self, records):
+        """(key, trajectory) of the records of select, loaded one at a time"""
+        for x in records:
+            yield (int(x['i']), int(x['j']), int(x['replica']), NET_TYPES[x['net_type']]), self._read(x)
+
+    def field(self, name, cell, net_type, replicas=None):
+        """One field of the replicas of a cell as a (replicas x T) matrix, the
+        shorter trajectories padded with their last value"""
+        series = [trajectory[name] for _, trajectory in self.iter(self.select(cell, replicas, net_type))]
+        T = max((len(s) for s in series), default=0)
+        return np.array([np.concatenate([s, np.full(T - len(s), s[-1])]) for s in series])
@@ -1,18 +1,20 @@
 import numpy as np   
 import networkx as nx
 import matplotlib.pyplot as plt
-import random
 import scipy
 from scipy import optimize
 import sys
+from fast_utils import graph_to_csr, graph_edges, edge_keys, edges_to_csr, random_neighbors, gather_neighbors, FlipTracker
 
 # Simple SIR process
 def SIR_net(G, beta, mu, initial_infecteds, seed=123):
     """G = network, beta = infection rate, mu = recovery rate,
-    initial_infecteds = list of infected nodes at time t=0 """
+    initial_infecteds = list of infected nodes at time t=0,
+    seed = seed of the np.random.Generator, that draws one block of uniform
+    numbers per step (a node recovers or gets infected by its k infectious
+    neighbours, with probability 1-(1-beta)^k, with its own number)"""
 
-    np.random.seed(seed)
-    random.seed(seed)
+    rng = np.random.default_rng(seed)
 
     #INITIALIZATION
     inf_status = {}  # infectious status of a node: 0 = susceptible; 1 = infectious; 2 = recovered 
@@ -39,16 +41,15 @@ def SIR_net(G, beta, mu, initial_infecteds, seed=123):
         t+=1
         time.append(t)
         # transmission and recovery
+        u = rng.random(N)
         for i in nx.nodes(G):
             if G.nodes[i]['inf_status'] == 1:
-                if random.random() < mu:
+                if u[i] < mu:
                     G.nodes[i]['new_inf_status'] = 2
             elif G.nodes[i]['inf_status'] == 0:
-                for j in nx.all_neighbors(G, i):
-                    if G.nodes[j]['inf_status'] == 1:
-                        if random.random() < beta:
-                            G.nodes[i]['new_inf_status'] = 1
-                            break  
+                k = sum(G.nodes[j]['inf_status'] == 1 for j in nx.all_neighbors(G, i))
+                if u[i] < 1 - (1 - beta)**k:
+                    G.nodes[i]['new_inf_status'] = 1
 
         # update infectious status                    
         for i in nx.nodes(G):
@@ -77,33 +78,53 @@ def SIR_net(G, beta, mu, initial_infecteds, seed=123):
 
     return np.array(time), np.array(S), np.array(I), np.array(R)
 
-def initNET_SI(G, I0, I_seed):
+def initNET_SI(G, I0, I_seed, rng=np.random.default_rng(123), p=0.1):
     """Initialize the information network with a SI model.
     G = network,
     I0 = number of desired initial infecteds,
-    I_seed = list of infecteds to start the initialization with"""
+    I_seed = list of infecteds to start the initialization with,
+    rng = np.random.Generator of the Bernoulli draws,
+    p = infection probability per edge and round.
+    Every round, an unaware node with k aware neighbours becomes aware with
+    probability 1 - (1 - p)^k (one coin per aware neighbour). Only the frontier
+    (unaware nodes with aware neighbours) is visited and its draws are done in
+    one batch; in the round that would overshoot I0 a random subset of the new
+    aware nodes is kept, so exactly I0 nodes end up aware (fewer only if the
+    component of the seeds is smaller). Returns the aware status array."""
 
-    aware_status = {}
-    for i in range(G.number_of_nodes()):
-        aware_status[i] = 0
-    for i in I_seed:
-        aware_status[i] = 1
+    N = G.number_of_nodes()
+    indptr, indices = graph_to_csr(G)
+    aware = np.zeros(N, dtype=bool)
+    aware[np.asarray(I_seed, dtype=np.int64)] = True
+    n_aware = int(np.count_nonzero(aware))
+    k_aware = np.zeros(N, dtype=np.int64)       # aware neighbours of every node
+    in_frontier = np.zeros(N, dtype=bool)
+    frontier = np.zeros(0, dtype=np.int64)
+    new = np.flatnonzero(aware)
+
+    # SI dynamics
+    while True:
+        # the neighbours of the newly aware nodes join the frontier
+        neighbours = gather_neighbors(indptr, indices, new)
+        k_aware += np.bincount(neighbours, minlength=N)
+        joining = np.unique(neighbours[~aware[neighbours] & ~in_frontier[neighbours]])
+        in_frontier[joining] = True
+        frontier = np.concatenate([frontier[~aware[frontier]], joining])
+        if n_aware >= I0 or len(frontier) == 0:
+            break
+
+        p_aware = 1. - (1. - p) ** k_aware[frontier]
+        new = frontier[rng.random(len(frontier)) < p_aware]
+        if n_aware + len(new) > I0:
+            new = rng.choice(new, I0 - n_aware, replace=False)
+        aware[new] = True
+        in_frontier[new] = False
+        n_aware += len(new)
+
+    aware_status = {i: int(aware[i]) for i in range(N)}
     nx.set_node_attributes(G, aware_status, 'aware_status')
     nx.set_node_attributes(G, aware_status, 'new_aware_status')
-    actual_infected = len(I_seed)
-    # SI dynamics
-    while actual_infected < I0:
-        for i in G.nodes():
-            if G.nodes[i]['aware_status'] == 0:                                                
-                for j in nx.all_neighbors(G, i):
-                    if G.nodes[j]['aware_status'] == 1:
-                        if random.random() < 0.1:                                             
-                            if G.nodes[i]['new_aware_status'] != 1 and actual_infected < I0:
-                                G.nodes[i]['new_aware_status'] = 1
-                                actual_infected += 1
-                            
-        for i in nx.nodes(G):
-                G.nodes[i]['aware_status'] = G.nodes[i]['new_aware_status']
+    return aware.astype(np.int8)
 
 def initNET_rnd(G, initial_novax):
     """Initialize the information network randomly from the initial_novax list"""
@@ -116,11 +137,163 @@ def initNET_rnd(G, initial_novax):
     nx.set_node_attributes(G, aware_status, 'new_aware_status')
 
 
+class IndexedSet:
+    """Set of hashable items with O(1) add, remove and uniform random choice
+    (items are kept in a list, together with their position in the list)."""
+
+    def __init__(self, items=()):
+        self.items = []
+        self.position = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.position
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item):
+        if item not in self.position:
+            self.position[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        """Remove item if present (swap with the last element and pop)"""
+        pos = self.position.pop(item, None)
+        if pos is None:
+            return
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.position[last] = pos
+
+    def choice(self, u):
+        """Element picked by the uniform random number u in [0, 1)"""
+        return self.items[int(u * len(self.items))]
+
+
+class TriangleCounter:
+    """Triangles of every node of a graph and the sum of the local clustering
+    coefficients, kept up to date while edges are added and removed.
+    adj maps every node to the collection of its neighbours (NET.adj, or a
+    list of IndexedSet); call edge_changed(a, b, +1) after adding the edge
+    (a, b) and edge_changed(a, b, -1) after removing it: the update costs
+    O(min(degree a, degree b)). Self loops are ignored, as in nx.clustering."""
+
+    def __init__(self, adj, N):
+        self.adj = adj
+        self.N = N
+        self.triangles = [0] * N
+        for i in range(N):
+            for j in adj[i]:
+                if j > i:
+                    for k in self.common(i, j):
+                        if k > j:
+                            self.triangles[i] += 1
+                            self.triangles[j] += 1
+                            self.triangles[k] += 1
+        self.total = sum(self.local(i) for i in range(N))
+
+    def degree(self, i):
+        return len(self.adj[i]) - (i in self.adj[i])
+
+    def local(self, i, d=None):
+        """Local clustering coefficient of node i (with degree d, if given)"""
+        d = self.degree(i) if d is None else d
+        return 2. * self.triangles[i] / (d * (d - 1)) if d > 1 else 0.
+
+    def common(self, a, b):
+        """Common neighbours of a and b (other than a and b)"""
+        small, large = (a, b) if len(self.adj[a]) <= len(self.adj[b]) else (b, a)
+        return [k for k in self.adj[small] if k in self.adj[large] and k != a and k != b]
+
+    def edge_changed(self, a, b, sign):
+        if a == b:
+            return
+        common = self.common(a, b)
+        # the degrees of a and b have already changed, the ones of the common neighbours have not
+        self.total -= self.local(a, self.degree(a) - sign) + self.local(b, self.degree(b) - sign)
+        for i in common:
+            self.total -= self.local(i)
+        self.triangles[a] += sign * len(common)
+        self.triangles[b] += sign * len(common)
+        for k in common:
+            self.triangles[k] += sign
+        for i in [a, b] + common:
+            self.total += self.local(i)
+
+    def average_clustering(self):
+        """Same as nx.average_clustering of the current graph"""
+        return self.total / self.N
+
+
+class DiscordantEdgeIndex:
+    """Index of the discordant edges (endpoints with different opinions) of the
+    information network NET, plus the pro vax / no vax node pools.
+    It is built once from the 'aware_status' attributes and then kept up to
+    date incrementally: call set_opinion when a node changes opinion and use
+    remove_edge / add_edge to modify NET.
+    With clustering=True the triangles of NET are tracked as well (see
+    TriangleCounter) and self.triangles.average_clustering() is always current."""
+
+    def __init__(self, NET, clustering=False):
+        self.NET = NET
+        self.triangles = TriangleCounter(NET.adj, NET.number_of_nodes()) if clustering else None
+        self.opinion = {i: NET.nodes[i]['aware_status'] for i in NET.nodes()}
+        self.pool = {0: IndexedSet(), 1: IndexedSet()}  # 0 = pro vax, 1 = no vax
+        for i, o in self.opinion.items():
+            self.pool[o].add(i)
+        self.edges = IndexedSet()
+        for a, b in NET.edges():
+            if self.opinion[a] != self.opinion[b]:
+                self.edges.add((min(a, b), max(a, b)))
+
+    def set_opinion(self, i, o):
+        """Node i now has opinion o: update the pools and its edges, O(degree)"""
+        if self.opinion[i] == o:
+            return
+        self.pool[self.opinion[i]].remove(i)
+        self.pool[o].add(i)
+        self.opinion[i] = o
+        for j in self.NET.neighbors(i):
+            edge = (min(i, j), max(i, j))
+            if self.opinion[j] != o:
+                self.edges.add(edge)
+            else:
+                self.edges.remove(edge)
+
+    def remove_edge(self, a, b):
+        self.NET.remove_edge(a, b)
+        self.edges.remove((min(a, b), max(a, b)))
+        if self.triangles is not None:
+            self.triangles.edge_changed(a, b, -1)
+
+    def add_edge(self, a, b):
+        """Add the edge (a, b) unless it exists or is a self-loop (as the rewiring
+        of fast_utils.py); returns whether it was added"""
+        if a == b or self.NET.has_edge(a, b):
+            return False
+        self.NET.add_edge(a, b)
+        if self.triangles is not None:
+            self.triangles.edge_changed(a, b, +1)
+        if self.opinion[a] != self.opinion[b]:
+            self.edges.add((min(a, b), max(a, b)))
+        return True
+
+    def random_node(self, o, u):
+        """Node with opinion o picked by the uniform random number u"""
+        return self.pool[o].choice(u)
+
+
 # We use just 2 states in the information network: PV and NV. The interaction between the two
 # follows a voter model, plus there is the effet of classical media acting on the NV population (a small effect that 
 # should account for the fact that, as time goes by, social and political pressure erode the NV population)
 
-def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), message=True):
+def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=True, rng=np.random.default_rng(123), message=True, opinions=False, clustering=False, profile=None, progress=None):
     """
     G: physical network
     NET: information network,
@@ -130,7 +303,24 @@ def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=
     pro: rate of classical media influence on people,
     pol: propensity of opinion polarization,
     initial_infecteds: list of infected nodes at time t=0,
-    rewiring: whether the information network should be static or dynamic"""
+    rewiring: whether the information network should be static or dynamic,
+    opinions: if True, the NV and PV time series are appended to the outputs,
+    clustering: if True, so is the average clustering coefficient of the
+    information network at every time step (tracked incrementally during
+    the rewiring),
+    profile: optional profiling.PhaseProfile that gets the wall time and the
+    operation counts of every phase of every time step,
+    progress: optional callable progress(t, infectious) called after every
+    time step (see telemetry.py).
+    The random numbers are drawn in blocks, one per phase and time step:
+    a coin per discordant edge, then two numbers per cut edge for the
+    rewiring; for the epidemic one number per node for the vaccination or
+    the recovery and one for the infection (1-(1-beta)^k with k infectious
+    neighbours, the law of one coin per infectious neighbour).
+    This is the reference implementation: the epidemic phase is still a
+    Python loop over the nodes, only the opinion phase works on arrays (kept
+    up to date incrementally); fast_utils.SIR_net_adaptive_csr is the same
+    model on arrays only."""
     
     #INITIALIZATION
     inf_status = {}
@@ -179,9 +369,7 @@ def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=
     
     ###################################
     # How many people did change idea?
-    lista = []
-    a = np.zeros(N)
-    lista.append(a)
+    tracker = FlipTracker(N)
 
     changers = []
     bichangers = []
@@ -191,93 +379,115 @@ def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=
     
     ###################################
     
+    # discordant edges and opinion pools, updated incrementally
+    if rewiring:
+        index = DiscordantEdgeIndex(NET, clustering=clustering)
+    # the information network as sorted edge keys and CSR (rebuilt from the
+    # keys after a rewiring), the opinions and the vaccinated as arrays
+    info_keys = edge_keys(N, *graph_edges(NET))
+    info_indptr, info_indices = graph_to_csr(NET)
+    aware = np.array([NET.nodes[i]['aware_status'] for i in range(N)])
+    vaccinated = np.array([G.nodes[i]['inf_status'] == 'V' for i in range(N)])
+    if clustering:
+        cc_static = None if rewiring else nx.average_clustering(NET)
+        CC = [index.triangles.average_clustering() if rewiring else cc_static]
+
     t = 0
     total_infected = 0
     while True:
-        
-
-        lista.append(a)
         t += 1
         time.append(t)
+        if profile is not None:
+            profile.step()
         
-        # REWIRING OF THE INFORMATION NETWORK 
-        if rewiring:                           
-            novax   = []
-            provax  = []
-        
-            for u in nx.nodes(NET):
-                if NET.nodes[u]['aware_status'] == 0:
-                    provax.append(u)
+        # REWIRING OF THE INFORMATION NETWORK
+        # (the discordant edges are taken from the index, so NET is never modified while iterating over it)
+        if rewiring:
+            discordant = list(index.edges)
+            cut = [edge for edge, coin in zip(discordant, rng.random(len(discordant))) if coin < pol]
+            rewires = len(cut)
+            added = []
+            for (i, j), (u_nv, u_pv) in zip(cut, rng.random((rewires, 2))):
+                index.remove_edge(i, j)
+                if index.opinion[i] == 1:
+                    nv, pv = i, j
                 else:
-                    novax.append(u)  
-
-            for i in nx.edges(NET):      
-                i = list(i)  
-                if (NET.nodes[i[0]]['aware_status'] + NET.nodes[i[1]]['aware_status'] == 1):      # two nodes with different opinions 
-                    if rng.random() < pol:    
-                        NET.remove_edge(i[0], i[1])
-                        if NET.nodes[i[0]]['aware_status'] == 1:
-                            NET.add_edge(i[0], rng.choice(novax)) 
-                            NET.add_edge(i[1], rng.choice(provax))
-                        else:
-                            NET.add_edge(i[1], rng.choice(novax)) 
-                            NET.add_edge(i[0], rng.choice(provax))
+                    nv, pv = j, i
+                for a, b in ((nv, index.random_node(1, u_nv)), (pv, index.random_node(0, u_pv))):
+                    if index.add_edge(a, b):
+                        added.append(min(a, b) * N + max(a, b))
+            if rewires:
+                # the added edges are concordant, so none of them is a cut one
+                info_keys = np.union1d(np.setdiff1d(info_keys, [i * N + j for i, j in cut], assume_unique=True), added)
+                info_indptr, info_indices = edges_to_csr(N, info_keys // N, info_keys % N)
+        if clustering:
+            CC.append(index.triangles.average_clustering() if rewiring else cc_static)
+        if profile is not None:
+            profile.lap('rewiring')
+            if rewiring:
+                profile.count(discordant_edges=len(discordant), rewires=rewires)
 
         # EPIDEMICS IN THE PHYSICAL NETWORK
-        
-        ###################################
-        bichanger = 0
-        changer = 0
-        ###################################
-        
-        
+        u_vax_rec, u_inf = rng.random((2, N))
         for i in nx.nodes(G):
             # all possible transitions
             if (NET.nodes[i]['aware_status'] == 0) and (G.nodes[i]['inf_status'] == 'S'):        # provax that get vaccinated
-                if rng.random() < r:
+                if u_vax_rec[i] < r:
                     G.nodes[i]['new_inf_status'] = 'V'
                     
             if G.nodes[i]['inf_status'] == 'I':                                                  # infectious that recover
-                if rng.random() < mu:
+                if u_vax_rec[i] < mu:
                     G.nodes[i]['new_inf_status'] = 'R'
                     
             elif G.nodes[i]['inf_status'] == 'S':                                                # susceptible
-                for j in nx.all_neighbors(G, i):
-                    if G.nodes[j]['inf_status'] == 'I':
-                        if rng.random() < beta:                                                  # here they get the disease
-                            G.nodes[i]['new_inf_status'] = 'I'
-                            G.nodes[i]['got_infected'] = 1
-                            
-            # EPIDEMICS IN THE INFORMATION NETWORK
-            
-            if rng.random() < pro:
-                NET.nodes[i]['new_aware_status'] = 0                                         # become a pro vax due to classical media
-                
-            else:                                                                            # or look around into social media
-                if G.nodes[i]['inf_status'] != 'V':
-                    neighbors = list(nx.all_neighbors(NET, i))
-                    target = rng.choice(neighbors, 1)[0]
-                    NET.nodes[i]['new_aware_status'] = NET.nodes[target]['aware_status']     # can become a pro/no vax via neighbours
-                    
-                    ###############################################################################
-                    if NET.nodes[target]['aware_status'] != NET.nodes[target]['new_aware_status']:
-                        lista[t][target] = 1
-                    if lista[t-1][target] == 1 :
-                        changer = changer +1
-                    if lista[t-2][target] == 1 and lista[t-1][target] == 1:
-                        bichanger = bichanger +1
-        #print(changer)
-            
-        changers.append(changer)
-        bichangers.append(bichanger)
+                k = sum(G.nodes[j]['inf_status'] == 'I' for j in nx.all_neighbors(G, i))
+                if k > 0 and u_inf[i] < 1 - (1 - beta)**k:                                      # here they get the disease
+                    G.nodes[i]['new_inf_status'] = 'I'
+                    G.nodes[i]['got_infected'] = 1
+        if profile is not None:
+            profile.lap('infection')
+            # every susceptible scans all its neighbours; the exposed ones (with an
+            # infectious neighbour) draw one number, as in fast_utils.py
+            sus = [i for i in G.nodes() if G.nodes[i]['inf_status'] == 'S']
+            profile.count(edges_scanned=sum(G.degree(i) for i in sus),
+                          infection_attempts=sum(any(G.nodes[j]['inf_status'] == 'I' for j in nx.all_neighbors(G, i)) for i in sus))
+
+        # EPIDEMICS IN THE INFORMATION NETWORK
+        # one batched step for all the nodes: a vector of media coin flips and
+        # one random neighbour per eligible node drawn from the CSR offsets
+        new_aware = aware.copy()
+
+        media = rng.random(N) < pro
+        new_aware[media] = 0                                                          # become a pro vax due to classical media
+        deg = info_indptr[1:] - info_indptr[:-1]
+        voters = np.flatnonzero(~media & ~vaccinated & (deg > 0))                     # or look around into social media
+        targets = random_neighbors(info_indptr, info_indices, voters, rng)
+        new_aware[voters] = aware[targets]                                            # can become a pro/no vax via neighbours
+
+        ###############################################################################
+        # nodes that change opinion in this step, and also did in the previous one
+        changer, bichanger = tracker.update(new_aware != aware)
+
+        changers.append(int(changer))
+        bichangers.append(int(bichanger))
+        if profile is not None:
+            profile.lap('voter')
+            profile.count(opinion_copies=len(voters), media=np.count_nonzero(media))
         
         ############################################################################################
         
         # UPDATE NETWORKS     
         for i in nx.nodes(G):
             G.nodes[i]['inf_status'] = G.nodes[i]['new_inf_status']
-        for i in nx.nodes(NET):
-            NET.nodes[i]['aware_status'] = NET.nodes[i]['new_aware_status']
+            vaccinated[i] = G.nodes[i]['inf_status'] == 'V'
+        for i in np.flatnonzero(new_aware != aware).tolist():                        # only the nodes that changed opinion
+            o = int(new_aware[i])
+            if rewiring:
+                index.set_opinion(i, o)
+            NET.nodes[i]['aware_status'] = NET.nodes[i]['new_aware_status'] = o
+        aware = new_aware
+        if profile is not None:
+            profile.lap('update')
 
 
         # COMPUTE THE TOTAL NUMBER OF SUSCEPTIBLE, INFECTED AND RECOVERED PEOPLE
@@ -296,18 +506,29 @@ def SIR_net_adaptive(G, NET, beta, mu, r, pro, pol, initial_infecteds, rewiring=
         I.append(infect)
         R.append(recov)
         V.append(vaccin)
+        NV.append(int(np.count_nonzero(new_aware)))
+        PV.append(N - NV[-1])
+        if profile is not None:
+            profile.lap('count')
 
         # end simulation if no more infectious are present
         if message:
             print(f'simulation until time t={t+1}', end='\r')
             sys.stdout.flush() 
+        if progress is not None:
+            progress(t, infect)
         if infect == 0:
             for _, data in G.nodes(data=True):
                 total_infected += data['got_infected']
             break
 
 
-    return np.array(time), np.array(S), np.array(I), np.array(R), np.array(V), total_infected, changers, bichangers
+    outputs = (np.array(time), np.array(S), np.array(I), np.array(R), np.array(V), total_infected, changers, bichangers)
+    if opinions:
+        outputs += (np.array(NV), np.array(PV))
+    if clustering:
+        outputs += (np.array(CC),)
+    return outputs
 
 def plot_info_network(G):
     nv_list = []